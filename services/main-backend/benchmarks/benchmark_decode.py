@@ -0,0 +1,75 @@
+"""
+Time frame sampling with full decoding (read) against grab/retrieve.
+
+Writes a synthetic video with cv2.VideoWriter, samples it with
+sample_video_frames in both modes and checks they return the same frames.
+
+    python benchmarks/benchmark_decode.py --frames 1200 --frame-skip 119
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from video import sample_video_frames
+
+def write_synthetic_video(video_path, frames, width, height, fps=60):
+    """Fabric-like noise scrolling up a few px per frame, with the frame number drawn on it."""
+    rng = np.random.default_rng(0)
+    roll = rng.integers(0, 256, (height * 2, width), dtype=np.uint8)
+    roll = cv2.GaussianBlur(roll, (5, 5), 0)
+
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f'Could not open a video writer for {video_path}')
+    try:
+        for i in range(frames):
+            top = (i * 5) % height
+            frame = cv2.cvtColor(roll[top:top + height], cv2.COLOR_GRAY2BGR)
+            cv2.putText(frame, str(i), (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 255), 3)
+            writer.write(frame)
+    finally:
+        writer.release()
+
+def time_sampling(video_path, frame_skip, skip_decode, repeat):
+    """Best time of repeat runs, and the sampled frames of the last one."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sampled = list(sample_video_frames(video_path, frame_skip, skip_decode))
+        best = min(best, time.perf_counter() - start)
+    return best, sampled
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=1200, help='Frames in the synthetic video')
+    parser.add_argument('--frame-skip', type=int, default=119, help='Keep one frame every frame-skip frames')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per mode, the best one is reported')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        video_path = os.path.join(folder, 'synthetic.mp4')
+        write_synthetic_video(video_path, args.frames, args.width, args.height)
+
+        read_secs, read_frames = time_sampling(video_path, args.frame_skip, False, args.repeat)
+        grab_secs, grab_frames = time_sampling(video_path, args.frame_skip, True, args.repeat)
+
+    read_indices = [index for index, _ in read_frames]
+    grab_indices = [index for index, _ in grab_frames]
+    assert read_indices == grab_indices, f'Sampled frames differ: {read_indices} != {grab_indices}'
+    assert read_indices == list(range(0, args.frames, args.frame_skip)), f'Unexpected frames: {read_indices}'
+    assert all(np.array_equal(a, b) for (_, a), (_, b) in zip(read_frames, grab_frames)), 'Sampled pixels differ'
+
+    print(f'{args.frames} frames {args.width}x{args.height}, {len(read_indices)} sampled every {args.frame_skip}')
+    print(f'read:          {read_secs:.3f}s ({args.frames / read_secs:.0f} frames/s)')
+    print(f'grab/retrieve: {grab_secs:.3f}s ({args.frames / grab_secs:.0f} frames/s)')
+    print(f'speedup:       {read_secs / grab_secs:.2f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+import os
+import json
+import bisect
+import threading
+
+class SessionStats:
+    """
+    Running statistics of a session, updated as frames and defects are recorded.
+
+    All updates and reads hold a lock, a snapshot is O(1) in the number of
+    defects (the histogram grows with the roll length only).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.defect_count = 0
+        self.class_counts = {}
+        self.defects_per_meter = []
+        self.last_frame_pos = None
+        self.first_time = None
+        self.last_time = None
+
+    def record_frame(self, frame_pos, frame_time):
+        with self.lock:
+            if self.last_frame_pos is None or frame_pos > self.last_frame_pos:
+                self.last_frame_pos = frame_pos
+            if self.first_time is None:
+                self.first_time = frame_time
+            self.last_time = frame_time
+
+    def record_defects(self, records):
+        with self.lock:
+            for record in records:
+                self.defect_count += 1
+                self.class_counts[record['class']] = self.class_counts.get(record['class'], 0) + 1
+
+                meter = int(record['roll_y_cm'] // 100)
+                if meter >= len(self.defects_per_meter):
+                    self.defects_per_meter.extend([0] * (meter + 1 - len(self.defects_per_meter)))
+                self.defects_per_meter[meter] += 1
+
+                # A reloaded session has no frame records, use its defects instead
+                if self.last_frame_pos is None or record['frame_pos'] > self.last_frame_pos:
+                    self.last_frame_pos = record['frame_pos']
+                if self.first_time is None:
+                    self.first_time = record['time']
+                self.last_time = max(self.last_time or record['time'], record['time'])
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'defect_count': self.defect_count,
+                'class_counts': dict(self.class_counts),
+                'defects_per_meter': list(self.defects_per_meter),
+                'last_frame_pos': self.last_frame_pos,
+                'elapsed_time': int(self.last_time - self.first_time) if self.first_time is not None else 0
+            }
+
+class DefectStore:
+    """
+    Append-only store for the defects of a session.
+
+    Metadata records are appended as JSON lines to defects.json and kept in
+    memory, so reads never parse the file again. The JPEG crops are appended
+    to crops.bin and the records only keep their offset and size, which
+    keeps the metadata small.
+
+    Records are indexed by class, by position along the roll and by time
+    as they are appended, for query.
+    """
+
+    def __init__(self, session_folder):
+        self.json_path = os.path.join(session_folder, 'defects.json')
+        self.crops_path = os.path.join(session_folder, 'crops.bin')
+        self.lock = threading.Lock()
+        self.records = []
+        self.crops_size = 0
+        self.stats = SessionStats()
+
+        # Ids by class, and sorted (roll_y_cm, id) and (time, id) keys
+        self.class_index = {}
+        self.position_index = []
+        self.time_index = []
+
+        # Reload a session that was recorded before a restart
+        if os.path.exists(self.json_path):
+            with open(self.json_path, 'r') as json_file:
+                self.records = [json.loads(line) for line in json_file if line.strip()]
+        if os.path.exists(self.crops_path):
+            self.crops_size = os.path.getsize(self.crops_path)
+        self.stats.record_defects(self.records)
+        self._index(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def _index(self, records):
+        for record in records:
+            self.class_index.setdefault(record['class'], []).append(record['id'])
+            # Frames arrive in order, so these are appends most of the time
+            bisect.insort(self.position_index, (record['roll_y_cm'], record['id']))
+            bisect.insort(self.time_index, (record['time'], record['id']))
+
+    def append(self, entries, crops):
+        """
+        Record new defects.
+
+        Args:
+            entries (list): Defect metadata dictionaries.
+            crops (list): JPEG encoded crop bytes, one per entry.
+
+        Returns:
+            list: The stored records, with their id and crop location.
+        """
+        if not entries:
+            return []
+
+        with self.lock:
+            new_records = []
+            lines = []
+            for entry, crop in zip(entries, crops):
+                record = dict(entry)
+                record['id'] = len(self.records) + len(new_records)
+                record['crop_offset'] = self.crops_size
+                record['crop_size'] = len(crop)
+                self.crops_size += len(crop)
+                new_records.append(record)
+                lines.append(json.dumps(record) + '\n')
+
+            with open(self.crops_path, 'ab') as crops_file:
+                crops_file.write(b''.join(crops))
+            with open(self.json_path, 'a') as json_file:
+                json_file.writelines(lines)
+
+            self.records.extend(new_records)
+            self.stats.record_defects(new_records)
+            self._index(new_records)
+            return new_records
+
+    def get_records(self, start=0, stop=None):
+        """Records with id in [start, stop), in insertion order."""
+        with self.lock:
+            return self.records[start:stop]
+
+    def query(self, classes=None, min_position_cm=None, max_position_cm=None, min_frame_pos=None, max_frame_pos=None,
+              min_pos_x=None, max_pos_x=None, min_confidence=None, since=None, until=None, cursor=0, limit=100):
+        """
+        Find defects matching all the given filters.
+
+        The candidates come from the most selective index among class, position
+        and time, then the remaining filters are checked on them.
+
+        Args:
+            classes (list): Class names to keep.
+            min_position_cm (float): Minimum position along the roll, in cm.
+            max_position_cm (float): Maximum position along the roll, in cm.
+            min_frame_pos (int): Minimum sampled frame number.
+            max_frame_pos (int): Maximum sampled frame number.
+            min_pos_x (int): Minimum horizontal position in the frame, in px.
+            max_pos_x (int): Maximum horizontal position in the frame, in px.
+            min_confidence (float): Minimum confidence.
+            since (int): Minimum record time, in seconds since epoch.
+            until (int): Maximum record time, in seconds since epoch.
+            cursor (int): Only return defects with id >= cursor.
+            limit (int): Maximum number of defects to return.
+
+        Returns:
+            tuple: (records ordered by id, cursor of the next page or None).
+        """
+        def key_range(index, low, high):
+            start = 0 if low is None else bisect.bisect_left(index, (low, -1))
+            stop = len(index) if high is None else bisect.bisect_right(index, (high, float('inf')))
+            return [record_id for _, record_id in index[start:stop]]
+
+        with self.lock:
+            candidates = []
+            if classes is not None:
+                candidates.append(sorted(record_id for class_name in set(classes)
+                                         for record_id in self.class_index.get(class_name, [])))
+            if min_position_cm is not None or max_position_cm is not None:
+                candidates.append(key_range(self.position_index, min_position_cm, max_position_cm))
+            if since is not None or until is not None:
+                candidates.append(key_range(self.time_index, since, until))
+
+            if candidates:
+                record_ids = sorted(min(candidates, key=len))
+            else:
+                record_ids = range(len(self.records))
+
+            # Skip to the cursor without scanning the earlier ids
+            record_ids = record_ids[bisect.bisect_left(record_ids, cursor):]
+
+            results = []
+            for record_id in record_ids:
+                record = self.records[record_id]
+                if (classes is None or record['class'] in classes) and \
+                    (min_position_cm is None or record['roll_y_cm'] >= min_position_cm) and \
+                    (max_position_cm is None or record['roll_y_cm'] <= max_position_cm) and \
+                    (min_frame_pos is None or record['frame_pos'] >= min_frame_pos) and \
+                    (max_frame_pos is None or record['frame_pos'] <= max_frame_pos) and \
+                    (min_pos_x is None or record['pos_x'] >= min_pos_x) and \
+                    (max_pos_x is None or record['pos_x'] <= max_pos_x) and \
+                    (min_confidence is None or record['confidence'] >= min_confidence) and \
+                    (since is None or record['time'] >= since) and \
+                    (until is None or record['time'] <= until):
+
+                    if len(results) == limit:
+                        return results, results[-1]['id'] + 1
+                    results.append(record)
+
+            return results, None
+
+    def read_crops(self, records):
+        """JPEG bytes of the crops of the given records."""
+        # The crops file only exists once a defect has been recorded
+        if not records:
+            return []
+
+        crops = []
+        with open(self.crops_path, 'rb') as crops_file:
+            for record in records:
+                crops_file.seek(record['crop_offset'])
+                crops.append(crops_file.read(record['crop_size']))
+        return crops
+
+# Stores of the sessions seen by this process, by session folder
+defect_stores = {}
+defect_stores_lock = threading.Lock()
+
+def get_defect_store(session_folder):
+    with defect_stores_lock:
+        if session_folder not in defect_stores:
+            defect_stores[session_folder] = DefectStore(session_folder)
+        return defect_stores[session_folder]
+
+def clear_defect_stores():
+    with defect_stores_lock:
+        defect_stores.clear()
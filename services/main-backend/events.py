@@ -0,0 +1,94 @@
+import json
+import queue
+import uuid
+import threading
+from collections import OrderedDict
+
+def new_epoch():
+    """Random tag of a version counter that starts over, in a new process or session."""
+    return uuid.uuid4().hex[:8]
+
+def format_version(epoch, version):
+    """Version given to clients, versions of another epoch never compare as newer or equal."""
+    return f'{epoch}-{version}'
+
+def parse_version(token, epoch):
+    """
+    Counter of a version sent back by a client.
+
+    Returns:
+        int: The counter, or -1 if the version is missing or from another epoch.
+    """
+    token_epoch, _, counter = (token or '').rpartition('-')
+    if token_epoch != epoch or not counter.isdigit():
+        return -1
+    return int(counter)
+
+class EventBroadcaster:
+    """
+    Fan-out of server-sent events to every connected client.
+
+    Every client gets its own bounded queue. A client that doesn't keep up
+    misses events instead of slowing down the publisher, it can catch up
+    with /get-frame. Idle clients only receive a keepalive comment.
+    """
+
+    def __init__(self, client_queue_size=32, keepalive_secs=15):
+        self.lock = threading.Lock()
+        self.clients = set()
+        self.client_queue_size = client_queue_size
+        self.keepalive_secs = keepalive_secs
+
+    def has_subscribers(self):
+        with self.lock:
+            return bool(self.clients)
+
+    def publish(self, event, data):
+        message = f'event: {event}\ndata: {json.dumps(data)}\n\n'
+        with self.lock:
+            clients = list(self.clients)
+
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                pass
+
+    def stream(self):
+        """Generator of the text/event-stream body of one client."""
+        client = queue.Queue(maxsize=self.client_queue_size)
+        with self.lock:
+            self.clients.add(client)
+
+        try:
+            while True:
+                try:
+                    yield client.get(timeout=self.keepalive_secs)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+        finally:
+            # Runs when the client disconnects
+            with self.lock:
+                self.clients.discard(client)
+
+class RecentFrames:
+    """The last annotated frames as JPEG bytes, by frame index."""
+
+    def __init__(self, size=16):
+        self.lock = threading.Lock()
+        self.frames = OrderedDict()
+        self.size = size
+
+    def add(self, frame_index, frame_jpeg):
+        with self.lock:
+            self.frames[frame_index] = frame_jpeg
+            while len(self.frames) > self.size:
+                self.frames.popitem(last=False)
+
+    def get(self, frame_index):
+        with self.lock:
+            return self.frames.get(frame_index)
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
@@ -0,0 +1,56 @@
+import queue
+import numpy as np
+from multiprocessing import shared_memory
+from inference import FRAME_WIDTH, FRAME_HEIGHT
+
+class FrameRing:
+    """
+    Ring of preprocessed frames in shared memory, between the decode and inference stages.
+
+    The decode stage writes every frame into a free slot and only the slot
+    number travels through the queues, so the inference workers read the
+    frame in place instead of receiving a pickled copy. A slot is busy from
+    acquire until release, acquire waits while every slot is busy
+    (backpressure on the decode stage).
+    """
+
+    def __init__(self, slots, frame_shape=(FRAME_HEIGHT, FRAME_WIDTH, 3)):
+        self.shape = (slots, *frame_shape)
+        self.memory = shared_memory.SharedMemory(create=True, size=int(np.prod(self.shape)))
+        self.frames = np.ndarray(self.shape, np.uint8, buffer=self.memory.buf)
+
+        self.free = queue.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def acquire(self, timeout=None):
+        """Index of a free slot, or None if none was released within timeout."""
+        try:
+            return self.free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def busy_slots(self):
+        return self.shape[0] - self.free.qsize()
+
+    def close(self):
+        del self.frames
+        self.memory.close()
+        self.memory.unlink()
+
+def attach_frame_ring(name, shape):
+    """
+    Frames of a ring created by another process.
+
+    Returns:
+        tuple: (shared memory, which must stay open while the frames are used, frames array).
+    """
+    memory = shared_memory.SharedMemory(name=name)
+    return memory, np.ndarray(shape, np.uint8, buffer=memory.buf)
@@ -0,0 +1,380 @@
+import os
+import cv2
+import time
+import threading
+import numpy as np
+from functools import lru_cache
+
+# Frame geometry fed to the patch classifier
+FRAME_WIDTH = 768
+FRAME_HEIGHT = 512
+CELL_SIZE = 64
+
+# Fixed batch ONNX exports larger than this many cells (4 frames) pad most batches they get
+ONNX_MAX_FIXED_BATCH = 4 * (FRAME_WIDTH // CELL_SIZE) * (FRAME_HEIGHT // CELL_SIZE)
+
+def preprocess_frame(frame, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    """
+    Grayscale and resize a BGR frame, returning a 3 channel image.
+
+    The resize runs on the single gray channel before it is replicated,
+    which gives the same pixels as resizing the merged image.
+
+    Args:
+        frame (np.ndarray): BGR frame as read from the video.
+        width (int): Output width.
+        height (int): Output height.
+
+    Returns:
+        np.ndarray: Gray image of shape (height, width, 3).
+    """
+    gray_image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    gray_image = cv2.resize(gray_image, (width, height))
+    return cv2.merge((gray_image, gray_image, gray_image))
+
+@lru_cache(maxsize=8)
+def cell_grid(width, height, cell_size=CELL_SIZE):
+    """
+    Coordinates (x1, y1, x2, y2) of every cell, row by row.
+
+    Cached, so it is computed only once per frame geometry.
+    """
+    return tuple((x, y, x + cell_size, y + cell_size)
+                 for y in range(0, height, cell_size)
+                 for x in range(0, width, cell_size))
+
+def tile_image(image, cell_size=CELL_SIZE):
+    """
+    Cut an image into a batch of square cells, in the same order as cell_grid.
+
+    The cells are taken as a single strided view of the image and copied once
+    into a contiguous batch, instead of slicing every cell in Python.
+
+    Args:
+        image (np.ndarray): Image of shape (height, width, channels), with
+            height and width multiples of cell_size.
+        cell_size (int): Side of the cells in pixels.
+
+    Returns:
+        np.ndarray: Batch of shape (cells, cell_size, cell_size, channels).
+    """
+    height, width, channels = image.shape
+    rows, cols = height // cell_size, width // cell_size
+    cells = image.reshape(rows, cell_size, cols, cell_size, channels).swapaxes(1, 2)
+    return np.ascontiguousarray(cells).reshape(rows * cols, cell_size, cell_size, channels)
+
+def neighbor_cascade(top1_ids, top1_confs, rows, cols, conf1, conf2, good_class=0):
+    """
+    Select the defect cells of a frame with the two threshold cascade.
+
+    A cell is a defect if its top class is not good_class with confidence
+    above conf1. Any of the 8 neighbors of such a cell is also a defect if
+    its top class is the same and its confidence is above conf2. The cells
+    are handled as a (rows, cols) grid, neighbors are found by dilating the
+    mask of each class, so the cost is linear in the number of cells.
+
+    Args:
+        top1_ids (np.ndarray): Top class of every cell, in cell_grid order.
+        top1_confs (np.ndarray): Confidence of the top class of every cell.
+        rows (int): Number of cell rows in the frame.
+        cols (int): Number of cell columns in the frame.
+        conf1 (float): Threshold for the defect cells.
+        conf2 (float): Threshold for the neighbors of defect cells.
+        good_class (int): Class id of defect free fabric.
+
+    Returns:
+        tuple: (cell indices, class ids) of the defect cells, first pass
+            cells first, then neighbor cells grouped by class.
+    """
+    ids = top1_ids.reshape(rows, cols)
+    confs = top1_confs.reshape(rows, cols)
+    kernel = np.ones((3, 3), np.uint8)
+
+    primary = (ids != good_class) & (confs > conf1)
+    cell_indices = [np.flatnonzero(primary)]
+
+    for class_id in np.unique(ids[primary]):
+        seeds = (primary & (ids == class_id)).astype(np.uint8)
+        neighbors = cv2.dilate(seeds, kernel).astype(bool) & ~primary
+        cell_indices.append(np.flatnonzero(neighbors & (ids == class_id) & (confs > conf2)))
+
+    cell_indices = np.concatenate(cell_indices)
+    return cell_indices, top1_ids[cell_indices]
+
+class CoarseStage:
+    """
+    First stage of the coarse-to-fine cascade.
+
+    The frames are downsampled by scale and cut into cells of the usual size,
+    so every coarse cell covers scale x scale frame cells, and a single batch
+    of them goes through the model. The frame cells under coarse cells that
+    are not confidently good, and their neighbors (for the conf2 re-check),
+    are the candidates for the full resolution classifier.
+    """
+
+    def __init__(self, scale=2, good_conf=0.9):
+        self.scale = scale
+        self.good_conf = good_conf
+
+    def candidates(self, model, images, good_class=0):
+        """
+        Args:
+            model: Inference engine with predict_probs.
+            images (list): Frames as returned by preprocess_frame, all of the same shape.
+            good_class (int): Class id of defect free fabric.
+
+        Returns:
+            np.ndarray: Candidate mask of the frame cells, frame by frame in cell_grid order.
+        """
+        height, width, _ = images[0].shape
+        if height % (CELL_SIZE * self.scale) or width % (CELL_SIZE * self.scale):
+            raise ValueError(f'Frames of {width}x{height} cannot be downsampled by {self.scale} into whole cells')
+
+        small_size = (width // self.scale, height // self.scale)
+        small_images = [cv2.resize(image, small_size, interpolation=cv2.INTER_AREA) for image in images]
+        probs = model.predict_probs(np.concatenate([tile_image(image, CELL_SIZE) for image in small_images]))
+
+        flagged = probs[:, good_class] < self.good_conf
+        flagged = flagged.reshape(len(images), small_size[1] // CELL_SIZE, small_size[0] // CELL_SIZE)
+        flagged = flagged.repeat(self.scale, axis=1).repeat(self.scale, axis=2).astype(np.uint8)
+
+        kernel = np.ones((3, 3), np.uint8)
+        return np.stack([cv2.dilate(frame_flagged, kernel) for frame_flagged in flagged]).astype(bool).reshape(-1)
+
+def classify_frames(model, images, conf1, conf2, gate=None, coarse=None, roi=None, good_class=0):
+    """
+    Find the defect cells of several frames.
+
+    The cells of all the frames go to the model as a single batch, then the
+    probabilities are split back by frame for the neighbor cascade. Cells can
+    be left out of the batch by the fabric region, a texture gate (unless it
+    is auditing) and a coarse stage, those are taken as good_class with
+    confidence 1.
+
+    Args:
+        model: Inference engine with predict_probs.
+        images (list): Frames as returned by preprocess_frame, all of the same shape.
+        conf1 (float): Threshold for the defect cells.
+        conf2 (float): Threshold for the neighbors of defect cells.
+        gate (TextureGate): Pre-filter of plain fabric cells, or None.
+        coarse (CoarseStage): First stage of the coarse-to-fine cascade, or None.
+        roi (np.ndarray): Mask of the cells of a frame covered by fabric, or None for all.
+        good_class (int): Class id of defect free fabric.
+
+    Returns:
+        tuple: (list of (cell indices, class ids, confidences) of the defect
+            cells of every frame, report with the cell counts and the time
+            spent in every stage).
+    """
+    timings = {}
+    stage_start = time.perf_counter()
+
+    def end_stage(stage):
+        nonlocal stage_start
+        now = time.perf_counter()
+        timings[stage] = now - stage_start
+        stage_start = now
+
+    height, width, _ = images[0].shape
+    rows, cols = height // CELL_SIZE, width // CELL_SIZE
+    cells = np.concatenate([tile_image(image, CELL_SIZE) for image in images])
+    end_stage('tiling')
+
+    predicted = np.ones(len(cells), bool) if roi is None else np.tile(roi, len(images))
+    if gate is not None:
+        needs_inference = gate.needs_inference(cells)
+        # In audit mode every cell still goes to the model, to count the defects the gate would miss
+        if not gate.audit:
+            predicted &= needs_inference
+        end_stage('gate')
+
+    if coarse is not None:
+        predicted &= coarse.candidates(model, images, good_class)
+        end_stage('coarse')
+
+    if predicted.all():
+        probs = model.predict_probs(cells)
+        top1_ids = probs.argmax(axis=1)
+        top1_confs = probs.max(axis=1)
+    else:
+        top1_ids = np.full(len(cells), good_class)
+        top1_confs = np.ones(len(cells), np.float32)
+        if predicted.any():
+            probs = model.predict_probs(cells[predicted])
+            top1_ids[predicted] = probs.argmax(axis=1)
+            top1_confs[predicted] = probs.max(axis=1)
+    end_stage('fine')
+
+    results = []
+    for start in range(0, len(cells), rows * cols):
+        frame_ids = top1_ids[start:start + rows * cols]
+        frame_confs = top1_confs[start:start + rows * cols]
+
+        # Filter defects and check neighbors cells (8 cells around central cell)
+        # with a smaller threshold for the main class
+        cell_indices, class_ids = neighbor_cascade(frame_ids, frame_confs, rows, cols, conf1, conf2, good_class)
+        results.append((cell_indices, class_ids, frame_confs[cell_indices]))
+    end_stage('cascade')
+
+    report = {
+        'frames': len(images),
+        'cells': len(cells),
+        'predicted_cells': int(predicted.sum()),
+        'timings': timings,
+        'gate': None
+    }
+
+    if gate is not None:
+        defect_cells = np.concatenate([start + cell_indices for start, (cell_indices, _, _)
+                                       in zip(range(0, len(cells), rows * cols), results)])
+        report['gate'] = {
+            'cells': len(cells),
+            'gated': int((~needs_inference).sum()),
+            'audit': gate.audit,
+            'defects': len(defect_cells),
+            'missed_defects': int((~needs_inference[defect_cells]).sum())
+        }
+
+    return results, report
+
+class InferenceCounters:
+    """
+    Frames, cells and time per stage of the inference stage, summed over the classify_frames reports.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.cells = 0
+        self.predicted_cells = 0
+        self.timings = {}
+
+    def add(self, report):
+        with self.lock:
+            self.frames += report['frames']
+            self.cells += report['cells']
+            self.predicted_cells += report['predicted_cells']
+            for stage, seconds in report['timings'].items():
+                self.timings[stage] = self.timings.get(stage, 0) + seconds
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'frames': self.frames,
+                'cells': self.cells,
+                'predicted_cells': self.predicted_cells,
+                'predicted_ratio': self.predicted_cells / self.cells if self.cells else 0,
+                'ms_per_frame': {stage: seconds * 1000 / self.frames for stage, seconds in self.timings.items()}
+            }
+
+class TorchEngine:
+    """
+    Patch classifier running a PyTorch checkpoint through ultralytics YOLO.predict.
+
+    Torch threads are a process wide setting, threads is only applied when given.
+    """
+
+    def __init__(self, model_path, threads=0):
+        # Imported with the first model, processes that never load one (decode workers) skip torch
+        import torch
+        from ultralytics import YOLO
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model_path = model_path
+        self.model = YOLO(model_path)
+        module = self.model.model
+        self.size_bytes = sum(tensor.numel() * tensor.element_size()
+                              for tensor in list(module.parameters()) + list(module.buffers()))
+
+    def predict_probs(self, cells):
+        """
+        Class probabilities of a batch of cells.
+
+        Args:
+            cells (np.ndarray): BGR cells of shape (cells, height, width, 3).
+
+        Returns:
+            np.ndarray: Array of shape (cells, classes) with the probabilities.
+        """
+        results = self.model.predict(source=list(cells), verbose=False)
+        return np.stack([result.probs.data.cpu().numpy() for result in results])
+
+class OnnxEngine:
+    """
+    Patch classifier running an exported ONNX model directly on onnxruntime CPU.
+
+    The cells are written into a preallocated float input buffer, converted
+    the same way the ultralytics classification predictor does (BGR to RGB,
+    scaled to [0, 1], channels first). Models exported with a fixed batch
+    size are run in chunks of that size. Input dimensions that are not fixed
+    numbers (ultralytics dynamic exports name them 'batch', 'height' and
+    'width') take the size of the cells given.
+    """
+
+    def __init__(self, model_path, threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.model_path = model_path
+
+        model_input = self.session.get_inputs()[0]
+        batch, _, height, width = [dim if isinstance(dim, int) else None for dim in model_input.shape]
+        self.input_name = model_input.name
+        self.fixed_batch = batch
+        # Cell size the model requires, None for a dynamic dimension
+        self.fixed_size = (height, width)
+        self.buffer = np.zeros((self.fixed_batch or 0, 3, height or CELL_SIZE, width or CELL_SIZE), np.float32)
+        if self.fixed_batch and self.fixed_batch > ONNX_MAX_FIXED_BATCH:
+            print(f"Warning: {model_path} has a fixed batch of {self.fixed_batch} cells, every call is padded "
+                  f"to it. Export it with a dynamic batch to classify frames faster.")
+        self.size_bytes = os.path.getsize(model_path)
+
+        # The input buffer is shared by all callers
+        self.lock = threading.Lock()
+
+    def predict_probs(self, cells):
+        """
+        Class probabilities of a batch of cells.
+
+        Args:
+            cells (np.ndarray): BGR cells of shape (cells, height, width, 3).
+
+        Returns:
+            np.ndarray: Array of shape (cells, classes) with the probabilities.
+        """
+        if any(fixed is not None and fixed != size for fixed, size in zip(self.fixed_size, cells.shape[1:3])):
+            raise ValueError(f'Cells of shape {cells.shape[1:3]} do not match the model input {self.fixed_size}')
+
+        input_shape = (3, *cells.shape[1:3])
+        batch_size = self.fixed_batch or len(cells)
+        probs = []
+
+        with self.lock:
+            if len(self.buffer) < batch_size or self.buffer.shape[1:] != input_shape:
+                self.buffer = np.zeros((max(batch_size, len(self.buffer)), *input_shape), np.float32)
+
+            for start in range(0, len(cells), batch_size):
+                chunk = cells[start:start + batch_size]
+                np.multiply(chunk[..., ::-1].transpose(0, 3, 1, 2), np.float32(1 / 255),
+                            out=self.buffer[:len(chunk)], casting='unsafe')
+
+                # A fixed batch model always gets the whole buffer, the tail is ignored
+                inputs = self.buffer[:batch_size] if self.fixed_batch else self.buffer[:len(chunk)]
+                probs.append(self.session.run(None, {self.input_name: inputs})[0][:len(chunk)])
+
+        return np.concatenate(probs)
+
+# Engines by name, each takes the path of its model file
+INFERENCE_ENGINES = {
+    'torch': TorchEngine,
+    'onnx': OnnxEngine
+}
+
+# Extension of the model file each engine runs
+ENGINE_MODEL_FORMATS = {
+    'torch': 'pt',
+    'onnx': 'onnx'
+}
@@ -0,0 +1,140 @@
+import os
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from inference import classify_frames
+from model_cache import warm_up_model
+from frame_ring import attach_frame_ring
+
+# Models kept loaded by a worker process, the one in use and the one about to be swapped in
+WORKER_MODELS = 2
+
+# Longest wait for every worker to pick up its preload task, they may be busy with a batch
+PRELOAD_TIMEOUT_SECS = 60
+
+# Models loaded by this worker process, as (engine class, model path) -> model, least recently used first
+worker_models = OrderedDict()
+worker_threads = 0
+worker_barrier = None
+
+# Frame ring attached by this worker process, as (name, shared memory, frames)
+worker_ring = (None, None, None)
+
+def init_worker(threads, barrier):
+    global worker_threads, worker_barrier
+    worker_threads = threads
+    worker_barrier = barrier
+
+def load_worker_model(engine, model_path):
+    """The worker's copy of a model, loaded from its file and warmed up the first time."""
+    key = (engine, model_path)
+    if key in worker_models:
+        worker_models.move_to_end(key)
+        return worker_models[key]
+
+    model = engine(model_path, threads=worker_threads)
+    warm_up_model(model)
+    worker_models[key] = model
+    while len(worker_models) > WORKER_MODELS:
+        worker_models.popitem(last=False)
+    return model
+
+def preload_in_worker(engine, model_path):
+    """
+    Load a model in this worker ahead of its first frames.
+
+    The worker then waits for all the others to get their own preload task,
+    so every worker runs exactly one.
+    """
+    load_worker_model(engine, model_path)
+    worker_barrier.wait(PRELOAD_TIMEOUT_SECS)
+    return os.getpid()
+
+def classify_frames_in_worker(engine, model_path, ring_name, ring_shape, slots, conf1, conf2, gate, coarse, roi):
+    """
+    classify_frames run in a worker process, on the worker's own copy of the model.
+
+    The model is loaded from its file the first time a worker sees it, unless
+    it was preloaded. The frames are read in place from their slots of the
+    frame ring.
+    """
+    global worker_ring
+    model = load_worker_model(engine, model_path)
+
+    if worker_ring[0] != ring_name:
+        worker_ring = (ring_name, *attach_frame_ring(ring_name, ring_shape))
+
+    return classify_frames(model, [worker_ring[2][slot] for slot in slots], conf1, conf2, gate, coarse, roi)
+
+class InferencePool:
+    """
+    Runs classify_frames for the inference stage on a pool of worker processes.
+
+    Every worker holds its own copy of the model and the CPU cores are split
+    between them, so batches of frames are classified in parallel. Results
+    come back as futures, the caller keeps them in frame order. With a single
+    worker the frames are classified in the calling thread, on the model it gives.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.executor = None
+        self.preload_lock = threading.Lock()
+
+        if workers > 1:
+            # Spawn keeps the workers from inheriting the server threads and model
+            context = multiprocessing.get_context('spawn')
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            self.barrier = context.Barrier(workers)
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                initializer=init_worker, initargs=(threads, self.barrier))
+
+    @property
+    def max_in_flight(self):
+        # 2 batches per worker keep them busy while the oldest result is recorded
+        return self.workers * 2 if self.executor else 1
+
+    def preload(self, model):
+        """
+        Load and warm up a model in every worker, before it is swapped in.
+
+        Otherwise every worker would load it on its first batch of the new
+        model, stalling the inference stage once per worker. Blocks until
+        all the workers have it. Nothing to do with a single worker, the
+        model given is already loaded.
+        """
+        if self.executor is None:
+            return
+
+        with self.preload_lock:
+            futures = [self.executor.submit(preload_in_worker, type(model), model.model_path)
+                       for _ in range(self.workers)]
+            try:
+                for future in futures:
+                    future.result()
+            finally:
+                # A worker that timed out breaks the barrier for the next preload
+                if self.barrier.broken:
+                    self.barrier.reset()
+
+    def submit(self, model, frame_ring, slots, conf1, conf2, gate=None, coarse=None, roi=None):
+        """
+        Classify the frames in some slots of the frame ring as one batch.
+
+        The slots must stay busy until the result is in.
+
+        Returns:
+            Future: Resolves to the classify_frames result.
+        """
+        if self.executor is not None:
+            return self.executor.submit(classify_frames_in_worker, type(model), model.model_path,
+                                        frame_ring.name, frame_ring.shape, slots, conf1, conf2, gate, coarse, roi)
+
+        future = Future()
+        try:
+            future.set_result(classify_frames(model, [frame_ring.frames[slot] for slot in slots],
+                                              conf1, conf2, gate, coarse, roi))
+        except Exception as e:
+            future.set_exception(e)
+        return future
@@ -0,0 +1,146 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Dummy batch run through every newly loaded model before it goes live
+WARMUP_BATCH_SIZE = 8
+WARMUP_CELL_SIZE = 64
+
+def warm_up_model(model):
+    """Run a dummy batch so lazy initialization doesn't land on the first frame."""
+    model.predict_probs(np.zeros((WARMUP_BATCH_SIZE, WARMUP_CELL_SIZE, WARMUP_CELL_SIZE, 3), np.uint8))
+
+class ModelCache:
+    """
+    LRU cache of loaded and warmed up models, keyed by (alias, registry version, engine).
+
+    Models are evicted, least recently used first, when there are more than
+    max_models of them or their weights take more than max_bytes. The most
+    recently used model is always kept.
+    """
+
+    def __init__(self, load_model, max_models=4, max_bytes=512 * 1024 * 1024):
+        self.load_model = load_model
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # Only one model is loaded at a time
+        self.load_lock = threading.Lock()
+        self.models = OrderedDict()
+
+    def get(self, alias, version, engine='torch'):
+        key = (alias, version, engine)
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key][0]
+
+        with self.load_lock:
+            # Loaded by another request while waiting for the lock
+            with self.lock:
+                if key in self.models:
+                    self.models.move_to_end(key)
+                    return self.models[key][0]
+
+            model = self.load_model(alias, version, engine)
+            warm_up_model(model)
+
+            with self.lock:
+                self.models[key] = (model, model.size_bytes)
+                self._evict()
+            return model
+
+    def _evict(self):
+        while len(self.models) > 1 and \
+            (len(self.models) > self.max_models or
+             sum(size for _, size in self.models.values()) > self.max_bytes):
+            self.models.popitem(last=False)
+
+class ModelSlot:
+    """
+    Double-buffered slot holding the model used by the inference stage.
+
+    A new model is staged once it is fully loaded and warmed up, and the
+    inference stage promotes it between frames, so a frame never sees a
+    partially initialized model. Frames hold the model they acquired until
+    they finish, the replaced model is released once none is using it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = None
+        self.active_name = None
+        self.staged = None
+        self.staged_name = None
+        self.loading = None
+        self.in_flight = {}
+        self.retired = []
+
+    def stage(self, model, name):
+        with self.lock:
+            self.staged = model
+            self.staged_name = name
+
+    def load_in_background(self, name, load):
+        """
+        Load a model in a background thread and stage it when ready.
+
+        Args:
+            name (tuple): (alias, version, engine) identifying the model.
+            load (callable): Returns the loaded and warmed up model.
+        """
+        def run():
+            try:
+                self.stage(load(), name)
+            except Exception as e:
+                print("Error loading model:", e)
+            finally:
+                with self.lock:
+                    if self.loading == name:
+                        self.loading = None
+
+        with self.lock:
+            self.loading = name
+        threading.Thread(target=run, daemon=True).start()
+
+    def promote(self):
+        """Swap in the staged model, if any. Called between frames."""
+        with self.lock:
+            if self.staged is None:
+                return False
+            if self.active is not None:
+                self.retired.append(self.active)
+            self.active, self.active_name = self.staged, self.staged_name
+            self.staged, self.staged_name = None, None
+            self._release_retired()
+            return True
+
+    @contextmanager
+    def acquire(self):
+        """Give the active model for the duration of a frame."""
+        with self.lock:
+            model = self.active
+            self.in_flight[id(model)] = self.in_flight.get(id(model), 0) + 1
+
+        try:
+            yield model
+        finally:
+            with self.lock:
+                self.in_flight[id(model)] -= 1
+                if not self.in_flight[id(model)]:
+                    del self.in_flight[id(model)]
+                self._release_retired()
+
+    def _release_retired(self):
+        # Drop the references to replaced models no frame is using anymore
+        self.retired = [model for model in self.retired if id(model) in self.in_flight]
+
+    def status(self):
+        with self.lock:
+            return {
+                'active': list(self.active_name) if self.active_name else None,
+                'staged': list(self.staged_name) if self.staged_name else None,
+                'loading': list(self.loading) if self.loading else None,
+                'retired_in_flight': len(self.retired)
+            }
@@ -0,0 +1,175 @@
+import os
+import json
+import threading
+import cv2
+import numpy as np
+from functools import lru_cache
+from inference import CELL_SIZE
+
+# Frames classified between two estimations of the fabric region
+ROI_REESTIMATE_FRAMES = 50
+
+# Estimates narrower than this share of the frame width are discarded
+ROI_MIN_WIDTH_RATIO = 0.25
+
+# A region narrower than the frame is only used once this many consecutive frames agree on it
+ROI_AGREEMENT_FRAMES = 3
+
+# Estimates agree when their edges are less than this apart, in px
+ROI_AGREEMENT_PX = CELL_SIZE
+
+# Columns are background only if their texture is below this share of the fabric texture
+ROI_BACKGROUND_CONTRAST = 0.5
+
+def estimate_fabric_columns(image):
+    """
+    Find the span of frame columns covered by fabric.
+
+    Fabric is textured along the roll while the machine bed around it is
+    not, so the gradient energy of every column is split in two with Otsu's
+    threshold and the widest run of textured columns is taken as the fabric.
+
+    Args:
+        image (np.ndarray): Frame as returned by preprocess_frame.
+
+    Returns:
+        tuple: (first column, end column) of the fabric in px, or None if no
+            fabric could be told apart from the background.
+    """
+    gray = image[..., 0].astype(np.float32)
+    width = gray.shape[1]
+    energy = np.abs(np.diff(gray, axis=0)).mean(axis=0)
+    energy = np.convolve(energy, np.ones(9) / 9, mode='same')
+
+    scaled = cv2.normalize(energy, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    _, textured = cv2.threshold(scaled.reshape(1, -1), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    textured = textured.ravel() > 0
+
+    # Fabric over the whole frame, there is no background to split off
+    if textured.all() or not textured.any() or \
+        energy[~textured].mean() > ROI_BACKGROUND_CONTRAST * energy[textured].mean():
+        return 0, width
+
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], textured.astype(np.int8), [0]])))
+    starts, ends = edges[::2], edges[1::2]
+    widest = np.argmax(ends - starts)
+    if ends[widest] - starts[widest] < ROI_MIN_WIDTH_RATIO * width:
+        return None
+    return int(starts[widest]), int(ends[widest])
+
+@lru_cache(maxsize=32)
+def roi_cell_mask(width, height, x_start, x_end, cell_size=CELL_SIZE):
+    """
+    Mask of the cells with their center inside the columns [x_start, x_end), in cell_grid order.
+
+    Cached, the returned array is read only.
+    """
+    centers = np.arange(0, width, cell_size) + cell_size / 2
+    columns = (centers >= x_start) & (centers < x_end)
+    mask = np.tile(columns, height // cell_size)
+    mask.setflags(write=False)
+    return mask
+
+class FabricRoi:
+    """
+    Region of the frames covered by fabric, for one session.
+
+    The region is estimated every ROI_REESTIMATE_FRAMES frames and its cell
+    mask is cached in between. Cells outside the region are never
+    classified, so a region narrower than the frame is only taken when
+    ROI_AGREEMENT_FRAMES consecutive frames agree on it, and then covers all
+    their estimates. Until then the previous region is kept. The whole frame
+    is taken at once. A manual override, in cm across the roll, is used
+    instead of the estimate when set, and kept in the session folder.
+    """
+
+    def __init__(self, session_folder, cm_per_px, auto=True):
+        self.path = os.path.join(session_folder, 'roi.json')
+        self.cm_per_px = cm_per_px
+        self.auto = auto
+        self.lock = threading.Lock()
+        self.override = None
+        self.estimate = None
+        self.candidates = []
+        self.frames_since_estimate = None
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as roi_file:
+                self.override = tuple(json.load(roi_file)['override_cm'])
+
+    def set_override(self, min_cm, max_cm):
+        with self.lock:
+            self.override = (min_cm, max_cm)
+            with open(self.path, 'w') as roi_file:
+                json.dump({'override_cm': self.override}, roi_file)
+
+    def clear_override(self):
+        with self.lock:
+            self.override = None
+            # Estimate again on the next frame
+            self.frames_since_estimate = None
+            self.candidates = []
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def cell_mask(self, images):
+        """
+        Mask of the cells inside the region, for frames about to be classified.
+
+        Args:
+            images (list): Frames as returned by preprocess_frame, used in
+                order while the region is estimated again.
+
+        Returns:
+            np.ndarray: Cell mask of one frame, or None if the region is the whole frame.
+        """
+        height, width, _ = images[0].shape
+        with self.lock:
+            if self.override is None and self.auto:
+                for image in images:
+                    if self.frames_since_estimate is not None and self.frames_since_estimate < ROI_REESTIMATE_FRAMES:
+                        break
+                    self._estimate(image, width)
+                if self.frames_since_estimate is not None:
+                    self.frames_since_estimate += len(images)
+
+            columns = self._columns(width)
+
+        if columns == (0, width):
+            return None
+        return roi_cell_mask(width, height, *columns)
+
+    def _estimate(self, image, width):
+        estimate = estimate_fabric_columns(image)
+
+        if estimate is not None and estimate != (0, width):
+            agreeing = [candidate for candidate in self.candidates
+                        if abs(candidate[0] - estimate[0]) < ROI_AGREEMENT_PX and
+                        abs(candidate[1] - estimate[1]) < ROI_AGREEMENT_PX]
+            # Only consecutive agreeing estimates count
+            self.candidates = agreeing + [estimate] if len(agreeing) == len(self.candidates) else [estimate]
+            if len(self.candidates) < ROI_AGREEMENT_FRAMES:
+                return
+            estimate = (min(start for start, _ in self.candidates), max(end for _, end in self.candidates))
+
+        self.estimate = estimate
+        self.candidates = []
+        self.frames_since_estimate = 0
+
+    def _columns(self, width):
+        if self.override is not None:
+            return (max(0, int(self.override[0] / self.cm_per_px)),
+                    min(width, int(np.ceil(self.override[1] / self.cm_per_px))))
+        if self.auto and self.estimate is not None:
+            return self.estimate
+        return 0, width
+
+    def status(self):
+        with self.lock:
+            return {
+                'auto': self.auto,
+                'override_cm': list(self.override) if self.override else None,
+                'estimate_cm': [column * self.cm_per_px for column in self.estimate] if self.estimate else None,
+                'pending_estimates': len(self.candidates),
+                'frames_since_estimate': self.frames_since_estimate
+            }
@@ -0,0 +1,165 @@
+import cv2
+import numpy as np
+
+# Largest sideways drift between two frames, a larger shift is taken as a false match
+SHIFT_MAX_DRIFT_PX = 8
+
+# Measured strides further than this share of the nominal stride from it are taken as false matches
+SHIFT_STRIDE_TOLERANCE = 0.5
+
+# Fewest rows two frames must share to be matched
+SHIFT_MIN_OVERLAP_PX = 32
+
+# Smallest normalized correlation of the overlapping rows taken as the same fabric
+SHIFT_MIN_CORRELATION = 0.6
+
+# Another shift correlating this close to the best one makes the match ambiguous (periodic texture)
+SHIFT_AMBIGUITY_RATIO = 0.8
+
+# Shifts closer than this to the best one belong to the same correlation peak
+SHIFT_PEAK_RADIUS_PX = 4
+
+def normalized_correlation(a, b):
+    """Pearson correlation of two arrays of the same shape, 0 if either is flat."""
+    a = a - a.mean()
+    b = b - b.mean()
+    norm = np.sqrt((a * a).sum() * (b * b).sum())
+    return float((a * b).sum() / norm) if norm > 0 else 0.0
+
+def estimate_frame_shift(previous, current, min_shift, max_shift):
+    """
+    Rows the fabric moved between two consecutive frames.
+
+    The fabric moves towards the top of the frame, so a row of the previous
+    frame shows up shift rows higher in the current one. Only shifts in
+    [min_shift, max_shift], around the nominal stride, are searched, so
+    static content (shift 0) is never taken as an overlap. The top rows of
+    the current frame are matched against the previous frame at every shift
+    of the band, by normalized correlation, and the best shift is kept when:
+
+    - the whole overlap of both frames correlates once aligned;
+    - no other shift of the band correlates about as well, as happens with
+      periodic texture.
+
+    Args:
+        previous (np.ndarray): Float32 gray previous frame.
+        current (np.ndarray): Float32 gray current frame, same shape.
+        min_shift (int): Smallest plausible shift in px.
+        max_shift (int): Largest plausible shift in px, below the frame height.
+
+    Returns:
+        float: Shift in px in [min_shift, max_shift], or None if the frames
+            don't overlap or the overlap can't be told for sure.
+    """
+    height, width = previous.shape
+    margin = SHIFT_MAX_DRIFT_PX
+
+    # Rows every shift of the band has in common, the margin leaves room for a sideways drift
+    template = np.ascontiguousarray(current[:height - max_shift, margin:width - margin])
+    scores = cv2.matchTemplate(np.ascontiguousarray(previous[min_shift:]), template, cv2.TM_CCOEFF_NORMED)
+    best_row, best_column = np.unravel_index(np.argmax(scores), scores.shape)
+    profile = scores.max(axis=1)
+
+    others = np.abs(np.arange(len(profile)) - best_row) > SHIFT_PEAK_RADIUS_PX
+    if others.any() and profile[others].max() >= SHIFT_AMBIGUITY_RATIO * profile[best_row]:
+        return None
+
+    # Column x of the previous frame is column x + drift of the current one
+    rows, drift = min_shift + int(best_row), margin - int(best_column)
+    overlap = normalized_correlation(previous[rows:, margin - drift:width - margin - drift],
+                                     current[:height - rows, margin:width - margin])
+    if overlap < SHIFT_MIN_CORRELATION:
+        return None
+
+    # Sub-pixel shift from a parabola through the peak and its neighbors
+    if 0 < best_row < len(profile) - 1:
+        before, peak, after = scores[best_row - 1:best_row + 2, best_column]
+        curvature = before - 2 * peak + after
+        if curvature < 0:
+            return float(np.clip(rows + (before - after) / (2 * curvature), min_shift, max_shift))
+    return float(rows)
+
+class RollTracker:
+    """
+    Position of the sampled frames along the roll, and detections repeated between them.
+
+    The stride between consecutive sampled frames is the fabric shift
+    measured between them when they overlap, and the nominal stride
+    otherwise, a full frame height by default (the spacing FRAME_SKIP is
+    tuned for). Only shifts within SHIFT_STRIDE_TOLERANCE of the nominal
+    stride are measured. A detection is a repeat when the previous frame had
+    one of the same class in the same column, less than a cell away along
+    the roll. With dedup off every detection is kept.
+    """
+
+    def __init__(self, cm_per_px, cell_size_px, nominal_stride_px=None, dedup=True):
+        self.cm_per_px = cm_per_px
+        self.cell_cm = cell_size_px * cm_per_px
+        self.nominal_stride_px = nominal_stride_px
+        self.dedup = dedup
+        self.previous_gray = None
+        self.previous_pos = None
+        self.offset_px = 0.0
+        self.overlapping = False
+        self.previous_detections = []
+
+    def advance(self, frame_pos, image):
+        """
+        Place the next frame on the roll.
+
+        Args:
+            frame_pos (int): Sampled frame number.
+            image (np.ndarray): Frame as returned by preprocess_frame.
+
+        Returns:
+            float: Position of the first row of the frame from the roll start, in px.
+        """
+        gray = image[..., 0].astype(np.float32)
+        height = gray.shape[0]
+        stride = self.nominal_stride_px or height
+
+        shift = None
+        if self.previous_pos is not None and frame_pos == self.previous_pos + 1:
+            min_shift = int(np.ceil(stride * (1 - SHIFT_STRIDE_TOLERANCE)))
+            max_shift = min(int(stride * (1 + SHIFT_STRIDE_TOLERANCE)), height - SHIFT_MIN_OVERLAP_PX)
+            if min_shift <= max_shift:
+                shift = estimate_frame_shift(self.previous_gray, gray, min_shift, max_shift)
+
+        if shift is not None:
+            self.offset_px += shift
+        elif self.previous_pos is not None and frame_pos > self.previous_pos:
+            self.offset_px += (frame_pos - self.previous_pos) * stride
+        else:
+            # First frame, or a session resumed after a restart
+            self.offset_px = float(frame_pos * stride)
+
+        self.overlapping = shift is not None
+        self.previous_gray = gray
+        self.previous_pos = frame_pos
+        return self.offset_px
+
+    def roll_position_cm(self, pos_x, pos_y):
+        """
+        Position of a pixel of the last placed frame on the roll.
+
+        Returns:
+            tuple: (across, along) the roll in cm, along is counted from the roll start.
+        """
+        return pos_x * self.cm_per_px, (self.offset_px + pos_y) * self.cm_per_px
+
+    def deduplicate(self, entries):
+        """
+        Indexes of the entries of the last placed frame that are not repeats.
+
+        All the entries are remembered for the next frame, repeats included,
+        so a defect seen in several frames is only kept the first time.
+        """
+        previous = self.previous_detections if self.overlapping and self.dedup else []
+        keep = [i for i, entry in enumerate(entries)
+                if not any(class_name == entry['class'] and
+                           abs(roll_x_cm - entry['roll_x_cm']) < self.cell_cm / 2 and
+                           abs(roll_y_cm - entry['roll_y_cm']) <= self.cell_cm
+                           for class_name, roll_x_cm, roll_y_cm in previous)]
+
+        self.previous_detections = [(entry['class'], entry['roll_x_cm'], entry['roll_y_cm']) for entry in entries]
+        return keep
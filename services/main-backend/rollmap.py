@@ -0,0 +1,198 @@
+import os
+import threading
+from events import new_epoch
+import numpy as np
+import matplotlib
+matplotlib.use('agg')
+import matplotlib.pyplot as plt
+
+# Length of roll covered by each rollmap plot, in cm
+ROLLMAP_XLIMIT = 80
+
+CLASS_COLORS = {'hole': 'red', 'objects': 'blue',
+                'oil spot': 'green', 'thread error': 'brown'}
+
+# Density raster bins are square, roughly the size of a frame cell on the roll
+DENSITY_BIN_CM = 2
+DENSITY_WIDTH_CM = 24
+DENSITY_TILE_BINS = 256
+DENSITY_LEVELS = 12
+
+class RollmapRenderer:
+    """
+    Renders the rollmap of a session as one scatter plot per ROLLMAP_XLIMIT cm.
+
+    The points of every segment are kept in memory. New defects only mark
+    their own segments as dirty, and only dirty segments are drawn again,
+    the finished ones stay cached on disk.
+    """
+
+    def __init__(self, rollmaps_folder):
+        self.rollmaps_folder = rollmaps_folder
+        self.lock = threading.Lock()
+        self.segments = {}
+        self.dirty = set()
+
+        # Every saved plot gets a new version, so clients can tell what changed
+        # Versions start over with every renderer, the epoch tells them apart
+        self.epoch = new_epoch()
+        self.version = 0
+        self.versions = {}
+
+    def add_defects(self, records):
+        with self.lock:
+            for record in records:
+                plot_index = int(record['roll_y_cm'] // ROLLMAP_XLIMIT)
+                x, y, c = self.segments.setdefault(plot_index, ([], [], []))
+                x.append(record['roll_y_cm'])
+                y.append(record['roll_x_cm'])
+                c.append(CLASS_COLORS[record['class']])
+                self.dirty.add(plot_index)
+
+    def render(self):
+        """
+        Draw the segments touched since the last call.
+
+        Returns:
+            list: Indexes of the rollmap plots that were saved.
+        """
+        with self.lock:
+            dirty = sorted(self.dirty)
+            self.dirty.clear()
+            segments = {plot_index: [list(values) for values in self.segments[plot_index]]
+                        for plot_index in dirty}
+
+        for plot_index in dirty:
+            x, y, c = segments[plot_index]
+            plt.figure(figsize=(8.7, 3), dpi=100)
+            plt.scatter(x, y, marker='o', color=c)
+            plt.xlim(ROLLMAP_XLIMIT * plot_index - 5,
+                     ROLLMAP_XLIMIT * (plot_index + 1))
+            plt.ylim(-2, 24)
+            plt.xlabel('Vertical position (cm)')
+            plt.ylabel('Horizontal position (cm)')
+            plt.grid(True)
+            save_path = os.path.join(
+                self.rollmaps_folder, f'rollmap_plot_{plot_index}.jpg')
+            plt.savefig(save_path, bbox_inches='tight')
+            plt.close()
+
+            with self.lock:
+                self.version += 1
+                self.versions[plot_index] = self.version
+
+        return dirty
+
+    def changed_since(self, version):
+        """
+        Plots saved after the given version.
+
+        Returns:
+            tuple: (current version, list of (plot index, version) pairs).
+        """
+        with self.lock:
+            changed = sorted((plot_index, plot_version) for plot_index, plot_version in self.versions.items()
+                             if plot_version > version)
+            return self.version, changed
+
+class DefectDensityMap:
+    """
+    Defect counts of a session on a raster of DENSITY_BIN_CM bins, by class.
+
+    Level 0 holds one row per bin along the roll, every next level halves the
+    rows (the roll width is small and is never downsampled). All levels are
+    updated in place as defects arrive, so reading a tile of the pyramid
+    costs the same at any zoom and for any roll length.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.classes = list(CLASS_COLORS)
+        self.across_bins = int(np.ceil(DENSITY_WIDTH_CM / DENSITY_BIN_CM))
+        self.levels = [np.zeros((len(self.classes), 0, self.across_bins), np.uint32)
+                       for _ in range(DENSITY_LEVELS)]
+        self.length_bins = 0
+        self.next_id = 0
+
+    def _grow(self, level, rows):
+        raster = self.levels[level]
+        if rows > raster.shape[1]:
+            # Double the capacity so growing is amortized over many defects
+            grown = np.zeros((raster.shape[0], max(rows, 2 * raster.shape[1], DENSITY_TILE_BINS), raster.shape[2]),
+                             np.uint32)
+            grown[:, :raster.shape[1]] = raster
+            self.levels[level] = grown
+
+    def add_defects(self, records):
+        with self.lock:
+            # Records are numbered by the defect store, skip the ones already counted
+            records = [record for record in records if record['id'] >= self.next_id]
+            if not records:
+                return
+
+            class_index = np.array([self.classes.index(record['class']) for record in records])
+            along = np.array([int(record['roll_y_cm'] // DENSITY_BIN_CM) for record in records])
+            across = np.array([int(record['roll_x_cm'] // DENSITY_BIN_CM) for record in records])
+            across = np.clip(across, 0, self.across_bins - 1)
+
+            for level in range(DENSITY_LEVELS):
+                rows = along >> level
+                self._grow(level, int(rows.max()) + 1)
+                np.add.at(self.levels[level], (class_index, rows, across), 1)
+
+            self.length_bins = max(self.length_bins, int(along.max()) + 1)
+            self.next_id = records[-1]['id'] + 1
+
+    def info(self):
+        with self.lock:
+            length_bins = self.length_bins
+        return {
+            'classes': self.classes,
+            'bin_cm': DENSITY_BIN_CM,
+            'across_bins': self.across_bins,
+            'tile_bins': DENSITY_TILE_BINS,
+            'length_cm': length_bins * DENSITY_BIN_CM,
+            'levels': [{'level': level,
+                        'bin_cm': DENSITY_BIN_CM * 2 ** level,
+                        'tiles': int(np.ceil((((length_bins - 1) >> level) + 1) / DENSITY_TILE_BINS)) if length_bins else 0}
+                       for level in range(DENSITY_LEVELS)]
+        }
+
+    def tile(self, level, tile_index, class_name=None):
+        """
+        Defect counts of one tile of the pyramid.
+
+        Args:
+            level (int): Pyramid level, every level doubles the bin length.
+            tile_index (int): Tile number along the roll.
+            class_name (str): Only count this class, or all classes if None.
+
+        Returns:
+            np.ndarray: Counts of shape (DENSITY_TILE_BINS, across_bins).
+        """
+        start = tile_index * DENSITY_TILE_BINS
+        with self.lock:
+            raster = self.levels[level][:, start:start + DENSITY_TILE_BINS].copy()
+
+        counts = np.zeros((DENSITY_TILE_BINS, self.across_bins), np.uint32)
+        if class_name is None:
+            counts[:raster.shape[1]] = raster.sum(axis=0)
+        else:
+            counts[:raster.shape[1]] = raster[self.classes.index(class_name)]
+        return counts
+
+# Density maps of the sessions seen by this process, by defect store
+density_maps = {}
+density_maps_lock = threading.Lock()
+
+def get_density_map(defect_store):
+    with density_maps_lock:
+        if defect_store.json_path not in density_maps:
+            density_map = DefectDensityMap()
+            density_map.add_defects(defect_store.get_records())
+            density_maps[defect_store.json_path] = density_map
+        return density_maps[defect_store.json_path]
+
+def clear_density_maps():
+    with density_maps_lock:
+        density_maps.clear()
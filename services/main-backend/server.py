@@ -3,18 +3,28 @@ import json
 import threading
 import cv2
 import shutil
-from ultralytics import YOLO
 import base64
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
-import pandas as pd
 import json
 import time
+import queue
+import atexit
 import requests
-from flask import Flask, request, jsonify
+from collections import deque
+from flask import Flask, Response, request, jsonify, make_response, send_file
 from flask_cors import CORS
 from process import process_bp, db, add, check_process_by_name
+from video import sample_video_frames_parallel
+from events import EventBroadcaster, RecentFrames, new_epoch, format_version, parse_version
+from defect_store import get_defect_store, clear_defect_stores
+from rollmap import RollmapRenderer, DENSITY_BIN_CM, DENSITY_TILE_BINS, DENSITY_LEVELS, get_density_map, clear_density_maps
+from model_cache import ModelCache, ModelSlot
+from inference import FRAME_WIDTH, FRAME_HEIGHT, CELL_SIZE, INFERENCE_ENGINES, ENGINE_MODEL_FORMATS, preprocess_frame, cell_grid
+from inference import CoarseStage, InferenceCounters
+from inference_pool import InferencePool
+from frame_ring import FrameRing
+from texture_gate import TextureGate, TextureGateCounters, read_class_cells
+from roi import FabricRoi
+from roll_tracker import RollTracker
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 app = Flask(__name__)
@@ -98,27 +108,66 @@ def upload_images():
         'class_names': class_names_array
     }), 201
 
-def fetch_model_file(model_name: str):
+MLFLOW_SERVER_URL = "http://localhost:8090"
+
+def fetch_model_version(model_name: str):
+    """
+    Fetch the registry version the model alias currently points to.
+
+    Args:
+        model_name (str): The alias name of the model.
+
+    Returns:
+        str: The registry version of the model.
+    """
+    response = requests.get(f"{MLFLOW_SERVER_URL}/model_version", params={'model': model_name})
+    if response.status_code == 200:
+        return str(response.json()['version'])
+    else:
+        raise Exception(f"Failed to fetch model version: {response.text}")
+
+def fetch_model_file(model_name: str, version: str, model_format: str = 'pt'):
     """
     Fetch the model file from the MLflow service.
 
     Args:
         model_name (str): The alias name of the model.
+        version (str): The registry version of the model.
+        model_format (str): 'pt' for the PyTorch weights, 'onnx' for the ONNX export.
 
     Returns:
         str: The path to the downloaded model file.
     """
-    MLFLOW_SERVER_URL = "http://localhost:8090"
-    response = requests.get(f"{MLFLOW_SERVER_URL}/fetch_model", params={'model': model_name})
+    response = requests.get(f"{MLFLOW_SERVER_URL}/fetch_model", params={'model': model_name, 'format': model_format})
     if response.status_code == 200:
-        model_file_path = os.path.join(BASE_DIR, 'models', "best.pt")
-        # model_file_path = os.path.join(BASE_DIR, 'models', f"{model_name}.pt")
+        model_file_path = os.path.join(BASE_DIR, 'models', f"{model_name}_v{version}.{model_format}")
         with open(model_file_path, 'wb') as f:
             f.write(response.content)
         return model_file_path
     else:
         raise Exception(f"Failed to fetch model: {response.text}")
 
+def load_model(model_name: str, version: str, engine: str):
+    """
+    Download a model and load it in an inference engine, used by the model cache on a miss.
+    """
+    model_file_path = fetch_model_file(model_name, version, ENGINE_MODEL_FORMATS[engine])
+    print(model_file_path)
+    return INFERENCE_ENGINES[engine](model_file_path)
+
+def load_staged_model(model_name: str, version: str, engine: str):
+    """
+    Get a model from the cache and load it in every inference worker, so it can be staged.
+
+    Workers that couldn't preload it load it on their first frames instead.
+    """
+    model = model_cache.get(model_name, version, engine)
+    try:
+        inference_pool.preload(model)
+    except Exception as e:
+        print(RED + "[load_staged_model]" + RESET + f" Model not preloaded in every worker: {e}")
+    return model
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -128,13 +177,15 @@ def upload_file():
         return jsonify({'error': 'No model specified'}), 400
 
     model_name = request.form['model']
+    engine = request.form.get('engine', INFERENCE_ENGINE)
+    if engine not in INFERENCE_ENGINES:
+        return jsonify({'error': f'Unknown inference engine "{engine}"'}), 400
 
     try:
-        global model
-        model_file_path = fetch_model_file(model_name)
-        print(model_file_path)
-        model = YOLO(model_file_path)
-        print(model)
+        # Only downloads and loads the model if this alias version isn't cached
+        # The inference stage swaps it in before the next frame
+        version = fetch_model_version(model_name)
+        model_slot.stage(load_staged_model(model_name, version, engine), (model_name, version, engine))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -161,7 +212,123 @@ def upload_file():
     else:
         return jsonify({'error': 'Only video files are allowed'}), 400
 
-def calculate_summary_data(json_file_path):
+@app.route('/model', methods=['GET'])
+def get_model_status():
+    return jsonify(model_slot.status()), 200
+
+@app.route('/model', methods=['POST'])
+def swap_model():
+    """
+    Change the model of the running inspection without stopping it.
+
+    The model is loaded and warmed up in the background, in every inference
+    worker too, then swapped in between two frames.
+    """
+    data = request.get_json(silent=True) or request.form
+    model_name = data.get('model')
+    if not model_name:
+        return jsonify({'error': 'No model specified'}), 400
+
+    engine = data.get('engine', INFERENCE_ENGINE)
+    if engine not in INFERENCE_ENGINES:
+        return jsonify({'error': f'Unknown inference engine "{engine}"'}), 400
+
+    try:
+        version = fetch_model_version(model_name)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    model_slot.load_in_background((model_name, version, engine), lambda: load_staged_model(model_name, version, engine))
+    return jsonify({'message': f'Loading model {model_name} version {version} on {engine}'}), 202
+
+@app.route('/roi', methods=['GET'])
+def get_roi():
+    if fabric_roi is None:
+        return jsonify({'error': 'No active session'}), 400
+    return jsonify(fabric_roi.status()), 200
+
+@app.route('/roi', methods=['POST'])
+def set_roi():
+    """
+    Override the fabric region of the active session, in cm across the roll.
+    """
+    if fabric_roi is None:
+        return jsonify({'error': 'No active session'}), 400
+
+    data = request.get_json(silent=True) or {}
+    try:
+        min_cm = float(data['min_cm'])
+        max_cm = float(data['max_cm'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'min_cm and max_cm are required numbers'}), 400
+
+    if min_cm >= max_cm:
+        return jsonify({'error': 'min_cm must be smaller than max_cm'}), 400
+
+    fabric_roi.set_override(min_cm, max_cm)
+    return jsonify(fabric_roi.status()), 200
+
+@app.route('/roi', methods=['DELETE'])
+def clear_roi():
+    if fabric_roi is None:
+        return jsonify({'error': 'No active session'}), 400
+    fabric_roi.clear_override()
+    return jsonify(fabric_roi.status()), 200
+
+@app.route('/inference/stats', methods=['GET'])
+def get_inference_stats():
+    return jsonify(inference_counters.snapshot()), 200
+
+@app.route('/texture-gate', methods=['GET'])
+def get_texture_gate():
+    return jsonify({
+        'gate': texture_gate.to_dict() if texture_gate else None,
+        'counters': texture_gate_counters.snapshot()
+    }), 200
+
+@app.route('/texture-gate', methods=['POST'])
+def configure_texture_gate():
+    """
+    Turn the texture gate or its audit mode on or off.
+    """
+    if texture_gate is None:
+        return jsonify({'error': 'Texture gate is not calibrated'}), 400
+
+    data = request.get_json(silent=True) or {}
+    texture_gate.enabled = bool(data.get('enabled', texture_gate.enabled))
+    texture_gate.audit = bool(data.get('audit', texture_gate.audit))
+    texture_gate.save(TEXTURE_GATE_FILE)
+    texture_gate_counters.reset()
+    return jsonify(texture_gate.to_dict()), 200
+
+@app.route('/texture-gate/calibrate', methods=['POST'])
+def calibrate_texture_gate():
+    """
+    Calibrate the texture gate on the good class of a dataset zip.
+
+    The zip holds a folder per class, as produced by /process_dataset.
+    """
+    global texture_gate
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+
+    class_name = request.form.get('className', 'good')
+    try:
+        cells = read_class_cells(request.files['file'], class_name, CELL_SIZE)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not len(cells):
+        return jsonify({'error': f'No images of class "{class_name}" found'}), 400
+
+    gate = TextureGate.calibrate(cells)
+    gate.audit = request.form.get('audit', 'false').lower() == 'true'
+    gate.save(TEXTURE_GATE_FILE)
+    texture_gate = gate
+    texture_gate_counters.reset()
+    return jsonify(gate.to_dict()), 201
+
+def calculate_summary_data(session_folder):
     summary_data = {
         'session_id': "",
         'elapsed_time': 0,
@@ -176,22 +343,30 @@ def calculate_summary_data(json_file_path):
     if active_session:
         summary_data['session_id'] = active_session
 
-        if os.path.exists(json_file_path):
-            df = pd.read_json(json_file_path, orient='records', lines=True)
-
-            if not df.empty:
-                first_entry = df.iloc[0]
-                last_entry = df.iloc[-1]
+        stats = get_defect_store(session_folder).stats.snapshot()
 
-                summary_data['defect_count'] = len(df)
-                summary_data['elapsed_time'] = int(last_entry['time'] - first_entry['time'])
-                summary_data['captures'] = int(last_entry['frame_pos']) + 1
-                summary_data['position'] = int(summary_data['captures'] * summary_data['speed'])
+        summary_data['defect_count'] = stats['defect_count']
+        summary_data['class_counts'] = stats['class_counts']
+        summary_data['defects_per_meter'] = stats['defects_per_meter']
+        summary_data['elapsed_time'] = stats['elapsed_time']
+        if stats['last_frame_pos'] is not None:
+            summary_data['captures'] = int(stats['last_frame_pos']) + 1
+            summary_data['position'] = int(summary_data['captures'] * summary_data['speed'])
 
     return summary_data
 
 @app.route('/get-frame', methods=['GET'])
 def get_frame_info():
+    """
+    Present the next ready frame and report the session assets.
+
+    When the client sends frame_version and/or rollmap_version, only the
+    assets newer than those versions are listed, as URLs of the binary
+    endpoints. Otherwise every asset is sent inline as base64. Versions are
+    opaque strings, those of a previous process or session are older than
+    any current one.
+    """
+    global last_frame, ready_frame
 
     # Check if there's an active session
     active_session = find_active_session()
@@ -203,26 +378,49 @@ def get_frame_info():
     if not os.path.exists(session_folder):
         return jsonify({'message': 'Session folders not created'}), 500
 
-    # Move a file that is ready to be displayed, if there's any
-    ready_folder = os.path.join(session_folder, "ready")
-    destination_path = os.path.join(session_folder, 'last.jpg')
-    ready_files = []
-    if os.path.exists(ready_folder):
-        ready_files = [f for f in os.listdir(ready_folder) if f.startswith('frame_') and f.endswith('.jpg')]
-        ready_files.sort(key=lambda x: int(x.split('_')[1].split('.')[0]))
+    # Take the newest annotated frame, if there's one not presented yet
+    # Concurrent requests must not give the same version to different frames
+    with last_frame_lock:
+        if ready_frame is not None:
+            frame_session, _, ready_image = ready_frame
+            ready_frame = None
+            if frame_session == active_session:
+                _, buffer = cv2.imencode('.jpg', ready_image)
+                last_frame = (last_frame[0] + 1, buffer.tobytes())
+
+        frame_version, frame_jpeg = last_frame
+
+    # Use the session statistics to build the summary_data object
+    summary_data = calculate_summary_data(session_folder)
+
+    # Delta mode, only send what changed since the versions known by the client
+    if 'frame_version' in request.args or 'rollmap_version' in request.args:
+        client_frame_version = parse_version(request.args.get('frame_version'), FRAME_EPOCH)
+
+        rollmap_version = None
+        rollmaps = []
+        renderer = rollmap_renderer
+        if renderer and renderer.rollmaps_folder == os.path.join(session_folder, 'rollmaps'):
+            client_rollmap_version = parse_version(request.args.get('rollmap_version'), renderer.epoch)
+            version, changed = renderer.changed_since(client_rollmap_version)
+            rollmap_version = format_version(renderer.epoch, version)
+            rollmaps = [{'index': plot_index, 'version': format_version(renderer.epoch, plot_version),
+                         'url': f'/rollmaps/{plot_index}'}
+                        for plot_index, plot_version in changed]
+
+        frame_changed = frame_jpeg is not None and frame_version > client_frame_version
+        return jsonify({
+            'frame_version': format_version(FRAME_EPOCH, frame_version),
+            'frame_url': '/frames/last' if frame_changed else None,
+            'rollmap_version': rollmap_version,
+            'rollmaps': rollmaps,
+            'summary': summary_data,
+            'message': f'Found {int(frame_changed)} new image and {len(rollmaps)} new rollmaps'
+        }), 200
 
-    if ready_files:
-        frame_to_process = ready_files[0]
-        frame_path = os.path.join(ready_folder, frame_to_process)
-
-        # Move the image file to the session folder
-        shutil.move(frame_path, destination_path)
-
-    # Get frame data from last image
     frame_data = None
-    if os.path.exists(destination_path):
-        with open(destination_path, 'rb') as frame_file:
-            frame_data = base64.b64encode(frame_file.read()).decode('utf-8')
+    if frame_jpeg is not None:
+        frame_data = base64.b64encode(frame_jpeg).decode('utf-8')
 
     # Get rollmap information from session
     rollmaps_images = []
@@ -234,10 +432,6 @@ def get_frame_info():
             with open(rollmap_path, 'rb') as rollmap_file:
                 rollmap_data = base64.b64encode(rollmap_file.read()).decode('utf-8')
                 rollmaps_images.append(rollmap_data)
-    
-    # Read defect.json to build the summary_data object
-    defect_json_path = os.path.join(session_folder, 'defects.json')
-    summary_data = calculate_summary_data(defect_json_path)
 
     return jsonify({
         'frame_data': frame_data,
@@ -246,6 +440,56 @@ def get_frame_info():
         'message': f'Found image and {len(rollmaps_images)} rollmaps'
     }), 200
 
+@app.route('/frames/last', methods=['GET'])
+def get_last_frame():
+    frame_version, frame_jpeg = last_frame
+
+    if frame_jpeg is None:
+        return jsonify({'message': 'No frame available'}), 404
+
+    # Answers 304 when the client already has this version
+    response = make_response(frame_jpeg)
+    response.mimetype = 'image/jpeg'
+    response.set_etag(format_version(FRAME_EPOCH, frame_version))
+    return response.make_conditional(request)
+
+@app.route('/frames/<int:frame_index>', methods=['GET'])
+def get_recent_frame(frame_index):
+    frame_jpeg = recent_frames.get(frame_index)
+
+    if frame_jpeg is None:
+        return jsonify({'error': 'Frame not available'}), 404
+
+    response = make_response(frame_jpeg)
+    response.mimetype = 'image/jpeg'
+    response.set_etag(f'{active_session}-{frame_index}')
+    return response.make_conditional(request)
+
+@app.route('/events', methods=['GET'])
+def stream_events():
+    """
+    Live inspection feed as server-sent events.
+
+    A 'frame' event is sent every time the inference stage finishes a frame,
+    with the URL of the annotated frame, the new defects and the summary.
+    """
+    return Response(inspection_events.stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/rollmaps/<int:plot_index>', methods=['GET'])
+def get_rollmap(plot_index):
+    active_session = find_active_session()
+
+    if not active_session:
+        return jsonify({'message': 'No active session'}), 404
+
+    rollmap_path = os.path.join(BASE_DIR, 'working', active_session, 'rollmaps', f'rollmap_plot_{plot_index}.jpg')
+    if not os.path.exists(rollmap_path):
+        return jsonify({'error': 'Rollmap not found'}), 404
+
+    # send_file sets an ETag and answers conditional requests with 304
+    return send_file(rollmap_path, mimetype='image/jpeg', conditional=True, max_age=0)
+
 def find_active_session():
     active_session_file_path = os.path.join(BASE_DIR, 'active_session.json')
 
@@ -272,35 +516,188 @@ def reset_sessions():
         if os.path.exists(active_session_file_path):
             os.remove(active_session_file_path)
 
+        # Forget the defect stores of the deleted sessions
+        clear_defect_stores()
+        clear_density_maps()
+
         return jsonify({'message': 'Sessions reset successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def format_defects(defect_store, records, crops_mode):
+    """Attach the crops to defect records as base64 ('inline'), as URLs ('url') or not at all ('none')."""
+    if crops_mode == 'inline':
+        crops = defect_store.read_crops(records)
+        return [dict(record, img_base64=base64.b64encode(crop).decode('utf-8'))
+                for record, crop in zip(records, crops)]
+    elif crops_mode == 'url':
+        return [dict(record, img_url=f'/defects/{record["id"]}/crop') for record in records]
+    else:
+        return records
+
 @app.route('/get-defects', methods=['GET'])
 def get_defects_info():
-
+    """
+    List the defects of the active session.
+
+    Query parameters:
+        cursor: Only return defects with id >= cursor. The response has the
+            next_cursor to send on the following call.
+        limit: Maximum number of defects to return.
+        crops: 'inline' (base64 img_base64), 'url' (img_url) or 'none'.
+            Defaults to 'inline' without a cursor and 'url' with one.
+    """
     active_session = find_active_session()
 
     if not active_session:
         return jsonify({'message': 'No active session'}), 404
 
-    json_file_path = os.path.join(BASE_DIR, 'working', active_session, 'defects.json')
+    defect_store = get_defect_store(os.path.join(BASE_DIR, 'working', active_session))
+
+    cursor = request.args.get('cursor', type=int)
+    limit = request.args.get('limit', type=int)
+    crops_mode = request.args.get('crops', 'inline' if cursor is None else 'url')
+    if crops_mode not in ('inline', 'url', 'none'):
+        return jsonify({'error': 'crops must be one of inline, url or none'}), 400
+    if (cursor is not None and cursor < 0) or (limit is not None and limit <= 0):
+        return jsonify({'error': 'Invalid cursor or limit'}), 400
 
     try:
-        # Check if the file exists
-        if os.path.exists(json_file_path) and os.path.isfile(json_file_path):
-            # Read the content of the JSON file
-            with open(json_file_path, 'r') as file:
-                json_data = [json.loads(line) for line in file]
-            # Return the JSON data as a response
-            return jsonify({'defects': json_data}), 200
-        else:
+        # Check if any defect was recorded
+        if cursor is None and not os.path.exists(defect_store.json_path):
             # Return a JSON response with an error message if the file does not exist
             return jsonify({'error': 'File not found'}), 404
+
+        start = cursor or 0
+        records = defect_store.get_records(start, start + limit if limit else None)
+
+        json_data = format_defects(defect_store, records, crops_mode)
+
+        # Return the JSON data as a response
+        return jsonify({'defects': json_data, 'next_cursor': start + len(records)}), 200
     except Exception as e:
         # Return a JSON response with the error message if an exception occurs
         return jsonify({'error': str(e)}), 500
 
+@app.route('/defects/query', methods=['GET'])
+def query_defects():
+    """
+    Find defects of the active session, e.g. all oil spots between meter 120 and 140.
+
+    Query parameters (all optional):
+        class: Class names, comma separated.
+        min_m, max_m: Position range along the roll, in meters.
+        min_frame_pos, max_frame_pos: Range of captured frames.
+        min_pos_x, max_pos_x: Horizontal band in the frame, in px.
+        min_confidence: Minimum confidence.
+        since, until: Time range, in seconds since epoch.
+        last_secs: Only defects recorded in the last seconds.
+        cursor, limit: Pagination, limit defaults to 100 (at most 1000).
+        crops: 'url' (default), 'inline' or 'none'.
+    """
+    active_session = find_active_session()
+
+    if not active_session:
+        return jsonify({'message': 'No active session'}), 404
+
+    defect_store = get_defect_store(os.path.join(BASE_DIR, 'working', active_session))
+    args = request.args
+
+    classes = args.get('class')
+    if classes is not None:
+        classes = [class_name.strip() for class_name in classes.split(',')]
+
+    # Positions along the roll are indexed in cm
+    min_position_cm = args.get('min_m', type=float)
+    max_position_cm = args.get('max_m', type=float)
+    min_position_cm = min_position_cm * 100 if min_position_cm is not None else None
+    max_position_cm = max_position_cm * 100 if max_position_cm is not None else None
+
+    since = args.get('since', type=int)
+    last_secs = args.get('last_secs', type=int)
+    if last_secs is not None:
+        since = max(since or 0, int(time.time()) - last_secs)
+
+    cursor = args.get('cursor', 0, type=int)
+    limit = min(args.get('limit', 100, type=int), 1000)
+    crops_mode = args.get('crops', 'url')
+    if crops_mode not in ('inline', 'url', 'none'):
+        return jsonify({'error': 'crops must be one of inline, url or none'}), 400
+    if cursor < 0 or limit <= 0:
+        return jsonify({'error': 'Invalid cursor or limit'}), 400
+
+    try:
+        records, next_cursor = defect_store.query(classes=classes,
+                                                  min_position_cm=min_position_cm,
+                                                  max_position_cm=max_position_cm,
+                                                  min_frame_pos=args.get('min_frame_pos', type=int),
+                                                  max_frame_pos=args.get('max_frame_pos', type=int),
+                                                  min_pos_x=args.get('min_pos_x', type=int),
+                                                  max_pos_x=args.get('max_pos_x', type=int),
+                                                  min_confidence=args.get('min_confidence', type=float),
+                                                  since=since,
+                                                  until=args.get('until', type=int),
+                                                  cursor=cursor,
+                                                  limit=limit)
+        return jsonify({'defects': format_defects(defect_store, records, crops_mode),
+                        'next_cursor': next_cursor}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/defects/<int:defect_id>/crop', methods=['GET'])
+def get_defect_crop(defect_id):
+    active_session = find_active_session()
+
+    if not active_session:
+        return jsonify({'message': 'No active session'}), 404
+
+    defect_store = get_defect_store(os.path.join(BASE_DIR, 'working', active_session))
+    records = defect_store.get_records(defect_id, defect_id + 1)
+    if not records:
+        return jsonify({'error': 'Defect not found'}), 404
+
+    # Crops never change once recorded
+    response = make_response(defect_store.read_crops(records)[0])
+    response.mimetype = 'image/jpeg'
+    response.set_etag(f'{active_session}-{defect_id}')
+    response.cache_control.max_age = 86400
+    return response.make_conditional(request)
+
+@app.route('/rollmap/density', methods=['GET'])
+def get_density_info():
+    active_session = find_active_session()
+
+    if not active_session:
+        return jsonify({'message': 'No active session'}), 404
+
+    defect_store = get_defect_store(os.path.join(BASE_DIR, 'working', active_session))
+    return jsonify(get_density_map(defect_store).info()), 200
+
+@app.route('/rollmap/density/<int:level>/<int:tile>', methods=['GET'])
+def get_density_tile(level, tile):
+    active_session = find_active_session()
+
+    if not active_session:
+        return jsonify({'message': 'No active session'}), 404
+
+    if level >= DENSITY_LEVELS:
+        return jsonify({'error': f'Level must be lower than {DENSITY_LEVELS}'}), 400
+
+    defect_store = get_defect_store(os.path.join(BASE_DIR, 'working', active_session))
+    density_map = get_density_map(defect_store)
+
+    class_name = request.args.get('class')
+    if class_name is not None and class_name not in density_map.classes:
+        return jsonify({'error': f'Unknown class "{class_name}"'}), 400
+
+    counts = density_map.tile(level, tile, class_name)
+    return jsonify({
+        'level': level,
+        'tile': tile,
+        'class': class_name,
+        'start_cm': tile * DENSITY_TILE_BINS * DENSITY_BIN_CM * 2 ** level,
+        'counts': counts.tolist()
+    }), 200
 
 # ANSI escape codes for text formatting
 RESET = "\033[0m"
@@ -321,8 +718,17 @@ WHITE = "\033[37m"
 # SECONDS TO SKIP = 600 / (60 * 5) = 2
 # FRAMES TO SKIP = (VIDEO ORIGINAL FPS * SECONDS TO SKIP) - 1 = (60 * 2) - 1 = 119
 FRAME_SKIP = 119
+
+# Only grab (don't decode) the frames skipped by FRAME_SKIP
+SKIP_DECODE = True
+
+# Number of worker processes decoding video segments in parallel (1 = sequential)
+DECODE_WORKERS = 1
 CLOCK_SECS = 1
-ROLLMAP_XLIMIT = 80
+
+# Bounded queue between the decode and inference stages
+# A full queue blocks the decode stage (backpressure)
+FRAME_QUEUE_SIZE = 8
 
 # Considering 512px = 15cm, 0.3 is the approximate ratio px/cm
 CAM_FRAME_HEIGHT_PX = 512
@@ -339,24 +745,83 @@ active_session = None
 
 working_folder = create_folder(os.path.join(BASE_DIR, 'working'))
 session_folder = None
-frames_folder = None
-ready_folder = None
-defects_data_json_path = None
 rollmaps_folder = None
-
-model = None
-
-defect_summary_data = { 
-        'Elapsed time (s)': 0,
-        'Captures': 0,
-        'Speed (m/min)': 49.6,
-        'Position (m)': 0,
-        'Defect Count': 0
-    }
+rollmap_renderer = None
+
+# Items are (session, frame_index, frame ring slot)
+frame_queue = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+
+# Shared memory holding the frames between decode and inference, created at startup
+frame_ring = None
+
+# (session, frame_index, frame) of the newest annotated frame not presented yet
+# Overwritten by every frame, so inference never waits for the dashboard
+ready_frame = None
+
+# (version, JPEG bytes) of the last presented frame
+# Both are only replaced while holding last_frame_lock, readers take the tuple as a whole
+# Versions start over in every process, FRAME_EPOCH tells them apart
+last_frame = (0, None)
+FRAME_EPOCH = new_epoch()
+last_frame_lock = threading.Lock()
+
+# Push channel of the live inspection feed
+inspection_events = EventBroadcaster()
+recent_frames = RecentFrames()
+
+# Engine running the patch classifier, 'torch' (ultralytics) or 'onnx' (onnxruntime CPU)
+INFERENCE_ENGINE = 'torch'
+
+# Model used by the inference stage, swapped between frames
+model_slot = ModelSlot()
+
+# Number of worker processes classifying frames in parallel, each with its own model copy
+# (1 = in the inference thread), created at startup
+INFERENCE_WORKERS = 1
+inference_pool = None
+
+# Cells of consecutive frames are classified together in batches of up to INFERENCE_BATCH_SIZE cells
+# A batch is sent once full or INFERENCE_MAX_WAIT_SECS after its first frame, whichever comes first
+INFERENCE_BATCH_SIZE = 384
+INFERENCE_MAX_WAIT_SECS = 0.05
+INFERENCE_BATCH_FRAMES = max(1, INFERENCE_BATCH_SIZE // ((FRAME_WIDTH // CELL_SIZE) * (FRAME_HEIGHT // CELL_SIZE)))
+
+# Optional pre-filter sending only the cells that don't look like plain fabric to the model
+# Calibrated with /texture-gate/calibrate, kept across restarts
+TEXTURE_GATE_FILE = os.path.join(BASE_DIR, 'texture_gate.json')
+texture_gate = TextureGate.load(TEXTURE_GATE_FILE) if os.path.exists(TEXTURE_GATE_FILE) else None
+texture_gate_counters = TextureGateCounters()
+
+# Coarse-to-fine cascade: a pass over the frame downsampled by COARSE_SCALE picks the regions
+# classified at full resolution, those confidently good (> COARSE_GOOD_CONF) are skipped (0 = off)
+COARSE_SCALE = 0
+COARSE_GOOD_CONF = 0.9
+coarse_stage = CoarseStage(COARSE_SCALE, COARSE_GOOD_CONF) if COARSE_SCALE > 1 else None
+
+# Detect the fabric region of every session and drop the cells outside it before inference
+ROI_AUTO = True
+fabric_roi = None
+
+# Position of the frames along the roll of the active session, and the detections of the last one
+# Detections repeated in the overlap of consecutive frames are stored once (False = store all)
+ROLL_DEDUP = True
+roll_tracker = None
+
+# Time spent in every inference stage, served by /inference/stats
+inference_counters = InferenceCounters()
+
+# Thresholds of the defect cells and of their neighbors
+CONF1 = 0.99
+CONF2 = 0.5
+
+# Loaded models, by alias and registry version, created at startup
+MODEL_CACHE_SIZE = 4
+MODEL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+model_cache = None
 
 # Function to check active_session.json and update global variable if necessary
 def check_active_session():
-    global active_session, session_folder, frames_folder, ready_folder, rollmaps_folder, defects_data_json_path
+    global active_session, session_folder, rollmaps_folder, rollmap_renderer, last_frame, ready_frame, fabric_roi, roll_tracker
     while True:
         print(RED + "[check_active_session]"  + RESET + " Checking for changes in active session...")
         try:
@@ -376,11 +841,24 @@ def check_active_session():
                         # Construct folder path for the new active session
                         session_folder = os.path.join(working_folder, new_active_session)
 
+                        # Frames from the previous session are no longer needed
+                        for _, _, slot in clear_queue(frame_queue):
+                            frame_ring.release(slot)
+                        with last_frame_lock:
+                            ready_frame = None
+                            last_frame = (last_frame[0] + 1, None)
+                        recent_frames.clear()
+
                         # Create necessary folders/files inside session folder
-                        frames_folder = create_folder(os.path.join(session_folder, "frames"))
-                        ready_folder = create_folder(os.path.join(session_folder, "ready"))
-                        defects_data_json_path = os.path.join(session_folder, "defects.json")
                         rollmaps_folder = create_folder(os.path.join(session_folder, 'rollmaps'))
+
+                        # Start the rollmap from the defects already recorded in the session
+                        rollmap_renderer = RollmapRenderer(rollmaps_folder)
+                        rollmap_renderer.add_defects(get_defect_store(session_folder).get_records())
+
+                        # The fabric region is estimated again for every session
+                        fabric_roi = FabricRoi(session_folder, CAM_FRAME_HEIGHT_CM / CAM_FRAME_HEIGHT_PX, ROI_AUTO)
+                        roll_tracker = RollTracker(CAM_FRAME_HEIGHT_CM / CAM_FRAME_HEIGHT_PX, CELL_SIZE, dedup=ROLL_DEDUP)
             else:
                 print(RED + "[check_active_session]" + RESET + " No session folder found")
 
@@ -388,58 +866,49 @@ def check_active_session():
         except Exception as e:
             print("Error occurred:", e)
 
-def split_list_by_limit(input_list, limit):
-    result = []
-    current_sum = 0
-    curr_limit = limit
-    sublist = []
-
-    for value in input_list:
-        if value <= curr_limit:
-            sublist.append(value)
-        else:
-            result.append(sublist)
-            sublist = [value]
-            curr_limit += limit
-
-    if sublist:
-        result.append(sublist)
-
-    return result
-
-def split_list_into_structure(input_list, structure):
-    result = []
-    idx = 0
-
-    for length in structure:
-        sublist = input_list[idx: idx + length]
-        result.append(sublist)
-        idx += length
+def clear_queue(target_queue):
+    """Empty a queue, returning the items that were dropped."""
+    items = []
+    while True:
+        try:
+            items.append(target_queue.get_nowait())
+        except queue.Empty:
+            return items
 
-    return result
+def put_while_session(target_queue, item, session):
+    """
+    Put an item in a bounded queue, waiting for room while the session is active.
 
-def save_entries_to_json(json_file, entries):
-    # Check if JSON file already exists
-    file_exists = os.path.exists(json_file)
+    Args:
+        target_queue (queue.Queue): Queue feeding the next stage.
+        item (tuple): Item to be queued.
+        session (str): Session the item belongs to.
 
-    # Convert the list of dictionaries to a pandas DataFrame
-    df = pd.DataFrame(entries)
+    Returns:
+        bool: True if the item was queued, False if the session changed meanwhile.
+    """
+    while session == active_session:
+        try:
+            target_queue.put(item, timeout=CLOCK_SECS)
+            return True
+        except queue.Full:
+            continue
+    return False
 
-    if file_exists:
-        mode = 'a'
-    else:
-        mode = 'w'
-    
-    # Save the DataFrame to the JSON file
-    df.to_json(json_file, mode=mode, orient='records', lines=True)
+def acquire_slot_while_session(session):
+    """
+    Wait for a free frame ring slot while the session is active.
 
-def read_entries_from_json(json_file):
-    df = pd.read_json(json_file)
-    entries = df.values.tolist()
-    return entries
+    Returns:
+        int: The slot, or None if the session changed meanwhile.
+    """
+    while session == active_session:
+        slot = frame_ring.acquire(timeout=CLOCK_SECS)
+        if slot is not None:
+            return slot
+    return None
 
 def break_video_into_frames():
-    global defect_summary_data
     while True:
         print(BLUE + "[break_video_into_frames]" + RESET + " Searching for new videos in session...")
 
@@ -449,270 +918,245 @@ def break_video_into_frames():
                 print(BLUE + "[break_video_into_frames]" + RESET + " Found new video in session folder!")
                 video_file = video_files[0]  # Assume only one video file in the folder
                 video_path = os.path.join(session_folder, video_file)
+                session = active_session
+
+                # Frames come back preprocessed, from the decode workers when there are some
+                for frame_count, frame in sample_video_frames_parallel(video_path, FRAME_SKIP, DECODE_WORKERS,
+                                                                       SKIP_DECODE, preprocess_frame):
+                    # Blocks while the inference stage is behind
+                    slot = acquire_slot_while_session(session)
+                    if slot is not None:
+                        frame_ring.frames[slot] = frame
+                        if put_while_session(frame_queue, (session, frame_count, slot), session):
+                            continue
+                        frame_ring.release(slot)
+
+                    print(BLUE + "[break_video_into_frames]" + RESET + " Session changed, dropping video")
+                    break
 
-                # Open the video file
-                cap = cv2.VideoCapture(video_path)
+                # Delete the video file
+                os.remove(video_path)
 
-                frame_count = 0
-                success, frame = cap.read()
+        # Wait for 5 seconds before checking again
+        time.sleep(5)
 
-                while success:
-                    if frame_count % FRAME_SKIP == 0:
-                        frame_path = os.path.join(frames_folder, f"frame_{frame_count}.jpg")
-                        cv2.imwrite(frame_path, frame)
-                        defect_summary_data['Captures'] += 1
+def collect_frame_batch(wait):
+    """
+    Take the next frames to classify together, up to INFERENCE_BATCH_FRAMES of them.
 
-                    success, frame = cap.read()
-                    frame_count += 1
+    Frames queued after the first one join the batch until it is full or
+    INFERENCE_MAX_WAIT_SECS have passed, which bounds the latency added to
+    a frame in live mode. A backlog fills the batch at once.
 
-                # Release the video capture object
-                cap.release()
+    Args:
+        wait (bool): Wait up to CLOCK_SECS for the first frame.
 
-                # Delete the video file
-                os.remove(video_path)
+    Returns:
+        list: (session, frame_index, slot) of the frames, in frame order.
+    """
+    batch = []
+    deadline = None
+    while len(batch) < INFERENCE_BATCH_FRAMES:
+        if deadline is None:
+            timeout = CLOCK_SECS if wait else 0
+        else:
+            timeout = deadline - time.monotonic()
 
-        # Wait for 5 seconds before checking again
-        time.sleep(5)
+        try:
+            if timeout > 0:
+                session, index, slot = frame_queue.get(timeout=timeout)
+            else:
+                session, index, slot = frame_queue.get_nowait()
+        except queue.Empty:
+            break
+
+        # Frame left over from a previous session
+        if session != active_session:
+            frame_ring.release(slot)
+            continue
 
-# Function to get coordinates of neighbors
-def get_neighbors_coordinates(x, y, img_width, img_height, cell_size):
-    neighbors = []
-    for i in range(max(0, x - cell_size), min(img_width, x + cell_size + 1), cell_size):
-        for j in range(max(0, y - cell_size), min(img_height, y + cell_size + 1), cell_size):
-            if i != x or j != y:
-                neighbors.append((i, j, i + cell_size, j + cell_size))
+        batch.append((session, index, slot))
+        if deadline is None:
+            deadline = time.monotonic() + INFERENCE_MAX_WAIT_SECS
 
-    return neighbors
+    return batch
 
 def process_frames_in_frames_folder():
-    global defect_summary_data
-    while True:
-        # Wait for 5 seconds before checking
-        time.sleep(5)
+    global processing
 
-        print(GREEN + "[process_frames_in_frames_folder]" + RESET + f" Searching for frames...")
+    # (frames, future) of the batches being classified, in frame order
+    pending = deque()
 
-        if not model:
+    while True:
+        model_slot.promote()
+        if not model_slot.active and not pending:
             print(GREEN + "[process_frames_in_frames_folder]" + RESET + f" Error: No model loaded yet. Skipping...")
+            time.sleep(CLOCK_SECS)
             continue
 
-        if not frames_folder or not os.path.exists(frames_folder):
-            print(GREEN + "[process_frames_in_frames_folder]" + RESET + f" Error: No frames folder found. Skipping...")
-            continue
-
-        frame_files = [f for f in os.listdir(frames_folder) if f.startswith('frame_') and f.endswith('.jpg')]
-        frame_files.sort(key=lambda x: int(x.split('_')[1].split('.')[0]))
+        # Keep the pool busy, only waiting for frames when none is in flight
+        if model_slot.active and len(pending) < inference_pool.max_in_flight:
+            batch = collect_frame_batch(wait=not pending)
+            if batch:
+                # A model staged while waiting for the frames is used from this batch on
+                model_slot.promote()
+
+                indexes = [index for _, index, _ in batch]
+                print(GREEN + "[process_frames_in_frames_folder]" + RESET + f" Processing frames {indexes}")
+                gate = texture_gate if texture_gate and texture_gate.enabled else None
+                roi = fabric_roi.cell_mask([frame_ring.frames[slot] for _, _, slot in batch]) if fabric_roi else None
+                with model_slot.acquire() as model:
+                    future = inference_pool.submit(model, frame_ring, [slot for _, _, slot in batch],
+                                                   CONF1, CONF2, gate, coarse_stage, roi)
+                pending.append((batch, future))
+                continue
+
+            if not pending:
+                processing = False
+                continue
+
+        # Results are recorded in frame order
+        batch, future = pending.popleft()
+        try:
+            results, report = future.result()
+            inference_counters.add(report)
+            if report['gate']:
+                texture_gate_counters.add(report['gate'])
+        except Exception as e:
+            print(GREEN + "[process_frames_in_frames_folder]" + RESET +
+                  f" Error processing frames {[index for _, index, _ in batch]}: {e}")
+            results = [None] * len(batch)
 
-        if not frame_files:
-            print(GREEN + "[process_frames_in_frames_folder]" + RESET + f" Error: No frame files found. Skipping...")
-            global processing
-            processing = False
-            continue
+        for (session, index, slot), result in zip(batch, results):
+            if result is None or session != active_session:
+                frame_ring.release(slot)
+                continue
 
-        print(GREEN + "[process_frames_in_frames_folder]" + RESET + f" Found frames!")
-
-        frame_to_process = frame_files[0]
-        frame_path = os.path.join(frames_folder, frame_to_process)
-        destination_path = os.path.join(ready_folder, frame_to_process)
-
-        # Read the frame, grayscale, resize frame
-        input_image = cv2.imread(frame_path)
-        gray_image = cv2.cvtColor(input_image, cv2.COLOR_BGR2GRAY)
-        input_image = cv2.merge((gray_image, gray_image, gray_image))
-        input_image = cv2.resize(input_image, (768, 512))
-
-        # Break the image into cells
-        cell_size = 64
-        img_height, img_width, _ = input_image.shape
-        images = []
-        image_coordinates = []
-        for y in range(0, img_height, cell_size):
-            for x in range(0, img_width, cell_size):
-                image = input_image[y:y+cell_size, x:x+cell_size]
-                images.append(image)
-                image_coordinates.append((x, y, x+cell_size, y+cell_size))
-
-        print(GREEN + "[process_frames_in_frames_folder]" + RESET + f" Number of patches: {len(images)}")
-
-        # Defect inference
-        conf1 = 0.99
-        results = model.predict(source=images)
-
-        # Filter defects and collect neighbors cells (8 cells around central cell)
-        # We perform a second detection on neighboring cells for the main class
-        neighbors_dict = {}  # Dictionary to store neighbors for each class
-        marked_images = []
-        top1 = []
-        confs = []
-        marked_coordinates = []
-        for i in range(len(images)):
-            if results[i].probs.top1 != 0 and results[i].probs.top1conf > conf1:
-                top1.append(int(results[i].probs.top1))
-                confs.append(results[i].probs.top1conf)
-                marked_images.append(images[i])
-                marked_coordinates.append(image_coordinates[i])
-
-                # Calculate neighbor cells
-                # Create/update dictionary based on class
-                neighbors = get_neighbors_coordinates(*image_coordinates[i][:2], img_height, img_width, cell_size)
-                class_id = results[i].probs.top1
-
-                if class_id not in neighbors_dict:
-                    neighbors_dict[class_id] = set()
-                neighbors_dict[class_id].update(neighbors)
-
-                # Remove marked images since they are not neighboring cells
-                neighbors_dict[class_id] = neighbors_dict[class_id] - set(marked_coordinates)
-
-        # Perform second prediction for neighbors
-        # Second prediction should have a smaller threshold
-        conf2 = 0.5
-
-        for class_id, neighbors in neighbors_dict.items():
-            neighbor_images = []
-            ncoords = []
-
-            for neighbor_coords in neighbors:
-                for i, coord in enumerate(image_coordinates):
-                    if neighbor_coords == coord:
-                        neighbor_images.append(images[i])
-                        ncoords.append(image_coordinates[i])
-
-            if neighbor_images:
-                neighbor_results = model.predict(source=neighbor_images)
-                for i in range(len(neighbor_images)):
-                    if neighbor_results[i].probs.top1 == class_id and \
-                        neighbor_results[i].probs.top1conf > conf2:
-                        
-                        top1.append(class_id)
-                        confs.append(neighbor_results[i].probs.top1conf)
-                        marked_images.append(neighbor_images[i])
-                        marked_coordinates.append(ncoords[i])
+            # The frame is drawn on and kept by the presentation stage, so the slot is freed from here on
+            input_image = frame_ring.frames[slot].copy()
+            frame_ring.release(slot)
+            record_frame(session, index, input_image, *result)
 
+def record_frame(session, index, input_image, marked_indices, marked_ids, confs):
+    """
+    Store the defects found in a frame, update the rollmap and hand the frame to the presentation stage.
+    """
+    cell_size = CELL_SIZE
+    img_height, img_width, _ = input_image.shape
+    image_coordinates = cell_grid(img_width, img_height, cell_size)
+    cell_count = len(image_coordinates)
+
+    top1 = [int(class_id) for class_id in marked_ids]
+    marked_coordinates = [image_coordinates[i] for i in marked_indices]
+    marked_images = [input_image[y1:y2, x1:x2] for x1, y1, x2, y2 in marked_coordinates]
+
+    print(GREEN + "[process_image]" + RESET +
+            f' Number of patches with defect: {len(marked_images)}')
+    print(GREEN + "[process_image]" + RESET +
+            f' Ratio defect/good: {len(marked_images)/cell_count*100}%')
+
+    # Place the frame on the roll, after the fabric shift measured from the previous frame
+    frame_pos = int(index/FRAME_SKIP)
+    roll_tracker.advance(frame_pos, input_image)
+
+    # Save defect images to dictionary
+    classes = ['good', 'hole', 'objects', 'oil spot', 'thread error']
+    new_entries = []
+
+    for i in range(len(marked_images)):
+        roll_x_cm, roll_y_cm = roll_tracker.roll_position_cm(*marked_coordinates[i][:2])
+        new_entries.append({'frame_pos': frame_pos,
+                            'frame_index': index,
+                            'camera': 'Cam_0',
+                            'class': classes[top1[i]],
+                            'confidence': float(confs[i]),
+                            'pos_x': marked_coordinates[i][0],
+                            'pos_y': marked_coordinates[i][1],
+                            'roll_x_cm': roll_x_cm,
+                            'roll_y_cm': roll_y_cm,
+                            'time': int(time.time())})
+
+    # Defects already recorded from the overlapping part of the previous frame are only drawn
+    kept = roll_tracker.deduplicate(new_entries)
+    if len(kept) < len(new_entries):
         print(GREEN + "[process_image]" + RESET +
-                f' Number of patches with defect: {len(marked_images)}')
-        print(GREEN + "[process_image]" + RESET +
-                f' Ratio defect/good: {len(marked_images)/len(images)*100}%')
-        defect_summary_data['Defect Count'] += len(marked_images)
-
-        # Save defect images to dictionary
-        classes = ['good', 'hole', 'objects', 'oil spot', 'thread error']
-        new_entries = []
-
-        # TODO: Bugs out when theres no marked images. Breaks defect listing too
-        for i in range(len(marked_images)):
-            # Convert the image to a base64 string
-            _, buffer = cv2.imencode('.jpg', marked_images[i])
-            base64_image = base64.b64encode(buffer).decode('utf-8')
-            index = int(frame_to_process.split('_')[1].split('.')[0])
-            new_entries.append({'frame_pos': int(index/FRAME_SKIP),
-                                'frame_index': index,
-                                'camera': 'Cam_0',
-                                'class': classes[top1[i]],
-                                'confidence': float(confs[i]),
-                                'pos_x': marked_coordinates[i][0],
-                                'pos_y': marked_coordinates[i][1],
-                                'time': int(time.time()),
-                                'img_base64': base64_image})
-
-        save_entries_to_json(defects_data_json_path, new_entries)
-
-        # Color the input image using colored markings
-        color_mapping = {
-            'good': (0, 255, 255),
-            'hole': (0, 0, 255),
-            'objects': (255, 0, 0),
-            'oil spot': (0, 255, 0),
-            'thread error': (42, 42, 165)
-        }
-        for i in range(len(marked_coordinates)):
-            x1, y1, x2, y2 = marked_coordinates[i]
-            cv2.rectangle(input_image, (x1, y1), (x2, y2), color_mapping[new_entries[i]['class']], 2)
-
-        # Save the colored image to the ready folder
-        cv2.imwrite(destination_path, input_image)
-        print(f"Moved {frame_to_process} to ready folder")
-
-        create_defect_scatter_plot()
-
-        # Remove the processed frame from the frames folder
-        os.remove(frame_path)
-
-def create_defect_scatter_plot():
-    global defect_summary_data
-    # Check if the 'defects.json' file exists
-    if not os.path.exists(defects_data_json_path):
-        print(
-            YELLOW + "[create_defect_scatter_plot]" + RESET + f" No {defects_data_json_path} file found.")
-        return -1
-
-    # Read data from the JSON file using pandas
-    df = pd.read_json(defects_data_json_path, orient='records', lines=True)
-
-    x_positions = []
-    y_positions = []
-    defect_class_color = []
-
-    # Get number of last detected frame to calculate actual cam position
-    # TODO: this used to bug out if no defects were detected ever, just bandaid fixed it
-    if df.index.size > 0:
-        defect_summary_data['Position (m)'] = ((df.iloc[-1]['frame_pos'] + 1) + 1) * CAM_FRAME_HEIGHT_CM / 100
-    else: defect_summary_data['Position (m)'] = CAM_FRAME_HEIGHT_CM / 100
-
-
-    classes = {'hole': 'red', 'objects': 'blue',
-               'oil spot': 'green', 'thread error': 'brown'}
-
-    for index, entry in df.iterrows():
-        frame_pos = int(entry['frame_pos'])
-        frame_class = entry['class']
-        pos_x = int(entry['pos_x'])
-        pos_y = int(entry['pos_y'])
-
-        # For 512px = 15cm, 0.3 is the approximate ratio px/cm
-        ratio = CAM_FRAME_HEIGHT_CM/CAM_FRAME_HEIGHT_PX
-        x_positions.append(ratio * (frame_pos * CAM_FRAME_HEIGHT_PX + pos_y))
-        y_positions.append(pos_x * ratio)
-        defect_class_color.append(classes[frame_class])
-
-    # If any position goes over limit it breaks it down into multiple lists
-    x_positions = split_list_by_limit(x_positions, ROLLMAP_XLIMIT)
-
-    # Match the same broken down structure of x_position to the others
-    y_positions = split_list_into_structure(
-        y_positions, [len(sublist) for sublist in x_positions])
-    defect_class_color = split_list_into_structure(
-        defect_class_color, [len(sublist) for sublist in x_positions])
-
-    plot_index = -1
-
-    for info in zip(x_positions, y_positions, defect_class_color):
-        plot_index += 1
-        x, y, c = info
-        plt.figure(figsize=(8.7, 3), dpi=100)
-        scatter = plt.scatter(x, y, marker='o', color=c)
-
-        # Create a custom legend
-        # legend_labels = [plt.Line2D([0], [0], marker='o', color='w', label=class_name,
-        #                             markerfacecolor=class_color) for class_name, class_color in classes.items()]
-
-        # plt.legend(handles=legend_labels, loc='upper right',
-        #            bbox_to_anchor=(1.24, 1.0))
-
-        plt.xlim(ROLLMAP_XLIMIT * plot_index - 5,
-                 ROLLMAP_XLIMIT * (plot_index + 1))
-        plt.ylim(-2, 24)
-        plt.xlabel('Vertical position (cm)')
-        plt.ylabel('Horizontal position (cm)')
-        plt.grid(True)
-        save_path = os.path.join(
-            rollmaps_folder, f'rollmap_plot_{plot_index}.jpg')
-        plt.savefig(save_path, bbox_inches='tight')
-        plt.close()
-
-    return plot_index
+                f' Repeated defects merged: {len(new_entries) - len(kept)}')
+
+    # Crops are stored apart from the metadata, as JPEG bytes
+    crops = [cv2.imencode('.jpg', marked_images[i])[1].tobytes() for i in kept]
+
+    defect_store = get_defect_store(session_folder)
+    defect_store.stats.record_frame(frame_pos, int(time.time()))
+    density_map = get_density_map(defect_store)
+    new_records = defect_store.append([new_entries[i] for i in kept], crops)
+    density_map.add_defects(new_records)
+
+    # Color the input image using colored markings
+    color_mapping = {
+        'good': (0, 255, 255),
+        'hole': (0, 0, 255),
+        'objects': (255, 0, 0),
+        'oil spot': (0, 255, 0),
+        'thread error': (42, 42, 165)
+    }
+    for i in range(len(marked_coordinates)):
+        x1, y1, x2, y2 = marked_coordinates[i]
+        cv2.rectangle(input_image, (x1, y1), (x2, y2), color_mapping[new_entries[i]['class']], 2)
+
+    saved_plots = create_defect_scatter_plot(new_records)
+
+    # The live feed and the presentation stage take the frame independently, neither waits for clients
+    publish_frame(session, index, input_image, new_records, saved_plots)
+
+    # Hand the colored image to the presentation stage, replacing a frame no one has presented
+    global ready_frame
+    with last_frame_lock:
+        ready_frame = (session, index, input_image)
+
+def publish_frame(session, index, input_image, new_records, saved_plots):
+    """
+    Push an annotated frame to the live feed.
+
+    The frame is only encoded if someone is listening. Clients that fall
+    behind miss events, so a dashboard on the live feed alone gets every
+    frame without ever polling /get-frame.
+    """
+    if not inspection_events.has_subscribers():
+        return
+
+    _, buffer = cv2.imencode('.jpg', input_image)
+    recent_frames.add(index, buffer.tobytes())
+    inspection_events.publish('frame', {
+        'session_id': session,
+        'frame_index': index,
+        'frame_url': f'/frames/{index}',
+        'defects': [dict(record, img_url=f'/defects/{record["id"]}/crop') for record in new_records],
+        'rollmaps': [f'/rollmaps/{plot_index}' for plot_index in saved_plots],
+        'summary': calculate_summary_data(session_folder)
+    })
+
+def create_defect_scatter_plot(new_records):
+    """
+    Update the rollmap plots with the defects recorded for a frame.
+
+    Only the plots of the segments that received new defects are drawn again.
+
+    Returns:
+        list: Indexes of the rollmap plots that were saved.
+    """
+    rollmap_renderer.add_defects(new_records)
+    return rollmap_renderer.render()
 
 if __name__ == '__main__':
+    # Spawned decode and inference workers import this file again as __mp_main__,
+    # everything they don't need is only created here
+    inference_pool = InferencePool(INFERENCE_WORKERS)
+    model_cache = ModelCache(load_model, MODEL_CACHE_SIZE, MODEL_CACHE_MAX_BYTES)
+
+    # One slot per queued frame and per frame in flight, plus the one being decoded
+    frame_ring = FrameRing(FRAME_QUEUE_SIZE + inference_pool.max_in_flight * INFERENCE_BATCH_FRAMES + 1)
+    atexit.register(frame_ring.close)
+
     # Start the thread
     active_session_thread = threading.Thread(target=check_active_session)
     active_session_thread.daemon = True
@@ -0,0 +1,17 @@
+from defect_store import DefectStore
+
+def entry(frame_pos, class_name='hole'):
+    return {'frame_pos': frame_pos, 'frame_index': frame_pos * 119, 'camera': 'Cam_0', 'class': class_name,
+            'confidence': 0.9, 'pos_x': 0, 'pos_y': 0, 'roll_x_cm': 1.0, 'roll_y_cm': frame_pos * 15.0,
+            'time': 1000 + frame_pos}
+
+def test_empty_session_reads_no_crops(tmp_path):
+    store = DefectStore(str(tmp_path))
+    assert store.read_crops(store.get_records()) == []
+    records, _ = store.query(classes=['hole'])
+    assert store.read_crops(records) == []
+
+def test_crops_are_read_back(tmp_path):
+    store = DefectStore(str(tmp_path))
+    store.append([entry(0), entry(1, 'oil spot')], [b'first', b'second crop'])
+    assert store.read_crops(store.get_records()) == [b'first', b'second crop']
@@ -0,0 +1,56 @@
+import os
+import numpy as np
+import pytest
+from inference_pool import InferencePool
+
+WORKERS = 2
+
+class FakeEngine:
+    """Engine writing the pid of the process loading it to a file in its model folder."""
+
+    def __init__(self, model_path, threads=0):
+        self.model_path = model_path
+        with open(os.path.join(model_path, 'loads'), 'a') as loads:
+            loads.write(f'{os.getpid()}\n')
+
+    def predict_probs(self, cells):
+        return np.full((len(cells), 5), 0.2, np.float32)
+
+def loads(model):
+    with open(os.path.join(model.model_path, 'loads')) as loads_file:
+        return [int(pid) for pid in loads_file.read().split()]
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = InferencePool(WORKERS)
+    yield pool
+    pool.executor.shutdown()
+
+def test_preload_loads_the_model_once_in_every_worker(pool, tmp_path):
+    model = FakeEngine(str(tmp_path))
+    pool.preload(model)
+    pool.preload(model)
+
+    worker_loads = loads(model)[1:]
+    assert len(worker_loads) == WORKERS
+    assert len(set(worker_loads)) == WORKERS
+    assert os.getpid() not in worker_loads
+
+def test_preload_keeps_the_active_model_loaded(pool, tmp_path):
+    (tmp_path / 'active').mkdir()
+    (tmp_path / 'staged').mkdir()
+    active = FakeEngine(str(tmp_path / 'active'))
+    staged = FakeEngine(str(tmp_path / 'staged'))
+
+    pool.preload(active)
+    pool.preload(staged)
+    # Batches of the active model keep running until the staged one is swapped in
+    pool.preload(active)
+
+    assert len(loads(active)) == 1 + WORKERS
+    assert len(loads(staged)) == 1 + WORKERS
+
+def test_preload_does_nothing_with_a_single_worker(tmp_path):
+    model = FakeEngine(str(tmp_path))
+    InferencePool(1).preload(model)
+    assert loads(model) == [os.getpid()]
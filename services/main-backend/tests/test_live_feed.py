@@ -0,0 +1,56 @@
+import json
+import queue
+import threading
+import numpy as np
+import pytest
+import server
+from inference import FRAME_WIDTH, FRAME_HEIGHT, CELL_SIZE
+from rollmap import RollmapRenderer
+from roll_tracker import RollTracker
+
+FRAMES = 20
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    session_folder = tmp_path / '1'
+    rollmaps_folder = session_folder / 'rollmaps'
+    rollmaps_folder.mkdir(parents=True)
+
+    monkeypatch.setattr(server, 'active_session', '1')
+    monkeypatch.setattr(server, 'session_folder', str(session_folder))
+    monkeypatch.setattr(server, 'rollmaps_folder', str(rollmaps_folder))
+    monkeypatch.setattr(server, 'rollmap_renderer', RollmapRenderer(str(rollmaps_folder)))
+    monkeypatch.setattr(server, 'roll_tracker', RollTracker(server.CAM_FRAME_HEIGHT_CM / server.CAM_FRAME_HEIGHT_PX, CELL_SIZE))
+    monkeypatch.setattr(server, 'ready_frame', None)
+    yield '1'
+    server.clear_defect_stores()
+    server.clear_density_maps()
+
+def test_live_feed_gets_every_frame_without_polling(session):
+    client = queue.Queue(maxsize=FRAMES)
+    with server.inspection_events.lock:
+        server.inspection_events.clients.add(client)
+
+    def record_frames():
+        rng = np.random.default_rng(0)
+        for i in range(FRAMES):
+            image = rng.integers(0, 256, (FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+            server.record_frame(session, i * server.FRAME_SKIP, image, [i % 10], [1], [0.9])
+
+    # Nobody calls /get-frame, recording must not wait for the presentation stage
+    try:
+        recorder = threading.Thread(target=record_frames, daemon=True)
+        recorder.start()
+        recorder.join(timeout=60)
+        assert not recorder.is_alive()
+    finally:
+        with server.inspection_events.lock:
+            server.inspection_events.clients.discard(client)
+
+    events = [client.get_nowait() for _ in range(client.qsize())]
+    assert len(events) == FRAMES
+    frame_indexes = [json.loads(event.split('data: ', 1)[1])['frame_index'] for event in events]
+    assert frame_indexes == [i * server.FRAME_SKIP for i in range(FRAMES)]
+
+    # Only the newest frame waits for the presentation stage
+    assert server.ready_frame[1] == (FRAMES - 1) * server.FRAME_SKIP
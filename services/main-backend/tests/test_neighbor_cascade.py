@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from types import SimpleNamespace
+from inference import CELL_SIZE, FRAME_WIDTH, FRAME_HEIGHT, cell_grid, neighbor_cascade
+
+ROWS, COLS = FRAME_HEIGHT // CELL_SIZE, FRAME_WIDTH // CELL_SIZE
+CONF1 = 0.99
+CONF2 = 0.5
+
+class StubModel:
+    """Stands in for YOLO.predict, the 'images' are cell indices with fixed results."""
+
+    def __init__(self, top1_ids, top1_confs):
+        self.top1_ids = top1_ids
+        self.top1_confs = top1_confs
+
+    def predict(self, source):
+        return [SimpleNamespace(probs=SimpleNamespace(top1=int(self.top1_ids[i]), top1conf=float(self.top1_confs[i])))
+                for i in source]
+
+def get_neighbors_coordinates(x, y, img_width, img_height, cell_size):
+    neighbors = []
+    for i in range(max(0, x - cell_size), min(img_width, x + cell_size + 1), cell_size):
+        for j in range(max(0, y - cell_size), min(img_height, y + cell_size + 1), cell_size):
+            if i != x or j != y:
+                neighbors.append((i, j, i + cell_size, j + cell_size))
+
+    return neighbors
+
+def two_pass_cascade(model, swapped_dims=True):
+    """
+    The nested loop cascade of process_frames_in_frames_folder before user-001, predicting twice.
+
+    swapped_dims keeps the original get_neighbors_coordinates call with width
+    and height swapped, which user-006 changed on purpose.
+    """
+    img_height, img_width, cell_size = FRAME_HEIGHT, FRAME_WIDTH, CELL_SIZE
+    image_coordinates = list(cell_grid(img_width, img_height, cell_size))
+    images = list(range(len(image_coordinates)))
+
+    results = model.predict(source=images)
+    neighbors_dict = {}
+    marked = []
+    marked_coordinates = []
+    for i in range(len(images)):
+        if results[i].probs.top1 != 0 and results[i].probs.top1conf > CONF1:
+            marked.append((i, results[i].probs.top1))
+            marked_coordinates.append(image_coordinates[i])
+
+            if swapped_dims:
+                neighbors = get_neighbors_coordinates(*image_coordinates[i][:2], img_height, img_width, cell_size)
+            else:
+                neighbors = get_neighbors_coordinates(*image_coordinates[i][:2], img_width, img_height, cell_size)
+            class_id = results[i].probs.top1
+            neighbors_dict.setdefault(class_id, set()).update(neighbors)
+            neighbors_dict[class_id] = neighbors_dict[class_id] - set(marked_coordinates)
+
+    for class_id, neighbors in neighbors_dict.items():
+        neighbor_images = [image_coordinates.index(coords) for coords in neighbors if coords in image_coordinates]
+        if neighbor_images:
+            neighbor_results = model.predict(source=neighbor_images)
+            for i in range(len(neighbor_images)):
+                if neighbor_results[i].probs.top1 == class_id and neighbor_results[i].probs.top1conf > CONF2:
+                    marked.append((neighbor_images[i], class_id))
+
+    return marked
+
+def random_grid(seed, defect_rate):
+    rng = np.random.default_rng(seed)
+    top1_ids = np.where(rng.random(ROWS * COLS) < defect_rate, rng.integers(1, 5, ROWS * COLS), 0)
+    # Confidences around both thresholds
+    top1_confs = rng.choice([0.3, 0.6, 0.995, 0.999], ROWS * COLS).astype(np.float32)
+    return top1_ids, top1_confs
+
+@pytest.mark.parametrize('seed', range(200))
+@pytest.mark.parametrize('defect_rate', [0.05, 0.3, 0.8])
+def test_matches_two_pass_cascade(seed, defect_rate):
+    top1_ids, top1_confs = random_grid(seed, defect_rate)
+    model = StubModel(top1_ids, top1_confs)
+
+    cell_indices, class_ids = neighbor_cascade(top1_ids, top1_confs, ROWS, COLS, CONF1, CONF2)
+    found = list(zip(cell_indices.tolist(), class_ids.tolist()))
+    expected = two_pass_cascade(model, swapped_dims=False)
+
+    # Same cells, each once, with the first pass cells in the same order first
+    assert sorted(found) == sorted(expected)
+    assert len(found) == len(set(found))
+    primary = [(i, int(top1_ids[i])) for i in range(ROWS * COLS) if top1_ids[i] != 0 and top1_confs[i] > CONF1]
+    assert found[:len(primary)] == expected[:len(primary)] == primary
+
+@pytest.mark.parametrize('seed', range(200))
+def test_finds_every_cell_of_the_original_cascade(seed):
+    # The original swapped width and height, missing neighbors of the right columns,
+    # never anything neighbor_cascade doesn't find
+    top1_ids, top1_confs = random_grid(seed, 0.3)
+    model = StubModel(top1_ids, top1_confs)
+
+    cell_indices, class_ids = neighbor_cascade(top1_ids, top1_confs, ROWS, COLS, CONF1, CONF2)
+    found = set(zip(cell_indices.tolist(), class_ids.tolist()))
+    assert set(two_pass_cascade(model)) <= found
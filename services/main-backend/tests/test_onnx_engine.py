@@ -0,0 +1,67 @@
+import numpy as np
+import onnxruntime
+import pytest
+from inference import OnnxEngine, CELL_SIZE, ONNX_MAX_FIXED_BATCH
+
+class FakeInput:
+    def __init__(self, shape):
+        self.name = 'images'
+        self.shape = shape
+
+class FakeSession:
+    """onnxruntime session of a classifier whose class 1 probability is the mean of the input."""
+
+    input_shape = None
+
+    def __init__(self, model_path, options, providers):
+        self.batches = []
+
+    def get_inputs(self):
+        return [FakeInput(self.input_shape)]
+
+    def run(self, outputs, feed):
+        images = feed['images']
+        self.batches.append(images.shape)
+        means = images.reshape(len(images), -1).mean(axis=1)
+        return [np.stack([1 - means, means], axis=1)]
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    def make(input_shape):
+        monkeypatch.setattr(FakeSession, 'input_shape', input_shape)
+        monkeypatch.setattr(onnxruntime, 'InferenceSession', FakeSession)
+        model_path = tmp_path / 'model.onnx'
+        model_path.write_bytes(b'onnx')
+        return OnnxEngine(str(model_path))
+    return make
+
+def cells(count, size=CELL_SIZE):
+    return np.stack([np.full((size, size, 3), 51 * (i % 6), np.uint8) for i in range(count)])
+
+@pytest.mark.parametrize('size', [CELL_SIZE, 32])
+def test_symbolic_input_takes_the_cells_size(engine, size):
+    model = engine(['batch', 3, 'height', 'width'])
+    probs = model.predict_probs(cells(10, size))
+
+    assert model.session.batches == [(10, 3, size, size)]
+    np.testing.assert_allclose(probs[:, 1], [(i % 6) / 5 for i in range(10)], atol=1e-6)
+
+def test_fixed_input_pads_to_the_batch(engine):
+    model = engine([8, 3, CELL_SIZE, CELL_SIZE])
+    probs = model.predict_probs(cells(10))
+
+    assert model.session.batches == [(8, 3, CELL_SIZE, CELL_SIZE)] * 2
+    assert probs.shape == (10, 2)
+
+def test_fixed_size_rejects_other_cells(engine):
+    model = engine(['batch', 3, CELL_SIZE, 'width'])
+    with pytest.raises(ValueError):
+        model.predict_probs(cells(4, 32))
+    assert model.predict_probs(cells(4)).shape == (4, 2)
+
+def test_large_fixed_batch_warns(engine, capsys):
+    engine([ONNX_MAX_FIXED_BATCH, 3, CELL_SIZE, CELL_SIZE])
+    assert 'Warning' not in capsys.readouterr().out
+
+    engine([999, 3, CELL_SIZE, CELL_SIZE])
+    assert 'fixed batch of 999 cells' in capsys.readouterr().out
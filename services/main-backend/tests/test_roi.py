@@ -0,0 +1,49 @@
+import numpy as np
+from inference import FRAME_WIDTH, FRAME_HEIGHT, CELL_SIZE
+from roi import FabricRoi, ROI_AGREEMENT_FRAMES, ROI_REESTIMATE_FRAMES
+
+CM_PER_PX = 15 / 512
+
+def fabric_frame(x_start=0, x_end=FRAME_WIDTH, seed=0):
+    """Frame with textured fabric in the columns [x_start, x_end) on a flat machine bed."""
+    image = np.full((FRAME_HEIGHT, FRAME_WIDTH, 3), 90, dtype=np.uint8)
+    texture = np.random.default_rng(seed).integers(0, 256, (FRAME_HEIGHT, x_end - x_start, 1), dtype=np.uint8)
+    image[:, x_start:x_end] = texture
+    return image
+
+def outside_cells(mask):
+    return None if mask is None else int((~mask).sum())
+
+def test_one_narrow_frame_does_not_narrow_the_region(tmp_path):
+    roi = FabricRoi(str(tmp_path), CM_PER_PX)
+    assert roi.cell_mask([fabric_frame(256, 512)]) is None
+    for seed in range(ROI_REESTIMATE_FRAMES):
+        assert roi.cell_mask([fabric_frame(seed=seed)]) is None
+
+def test_agreeing_frames_narrow_the_region(tmp_path):
+    roi = FabricRoi(str(tmp_path), CM_PER_PX)
+    for seed in range(ROI_AGREEMENT_FRAMES - 1):
+        assert roi.cell_mask([fabric_frame(256, 512, seed)]) is None
+
+    mask = roi.cell_mask([fabric_frame(256 + CELL_SIZE // 2, 512, ROI_AGREEMENT_FRAMES)])
+    columns = mask[:FRAME_WIDTH // CELL_SIZE]
+    assert columns[256 // CELL_SIZE:512 // CELL_SIZE].all()
+    assert not columns[:256 // CELL_SIZE].any() and not columns[512 // CELL_SIZE:].any()
+
+def test_agreement_within_one_batch(tmp_path):
+    roi = FabricRoi(str(tmp_path), CM_PER_PX)
+    mask = roi.cell_mask([fabric_frame(256, 512, seed) for seed in range(ROI_AGREEMENT_FRAMES)])
+    assert outside_cells(mask) == (FRAME_WIDTH - 256) // CELL_SIZE * (FRAME_HEIGHT // CELL_SIZE)
+
+def test_disagreeing_frames_keep_the_previous_region(tmp_path):
+    roi = FabricRoi(str(tmp_path), CM_PER_PX)
+    for seed in range(2 * ROI_AGREEMENT_FRAMES):
+        x_start = 128 if seed % 2 else 320
+        assert roi.cell_mask([fabric_frame(x_start, x_start + 320, seed)]) is None
+    assert roi.status()['pending_estimates'] == 1
+
+def test_whole_frame_is_taken_at_once(tmp_path):
+    roi = FabricRoi(str(tmp_path), CM_PER_PX)
+    roi.cell_mask([fabric_frame(256, 512, seed) for seed in range(ROI_AGREEMENT_FRAMES)])
+    roi.frames_since_estimate = ROI_REESTIMATE_FRAMES
+    assert roi.cell_mask([fabric_frame()]) is None
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from roll_tracker import RollTracker
+
+HEIGHT, WIDTH = 512, 768
+CM_PER_PX = 15 / 512
+CELL_SIZE = 32
+
+def textured_roll(length, seed=0):
+    """Random fabric texture, smoothed so it looks like a camera picture."""
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(128, 40, (length, WIDTH + 4)).astype(np.float32)
+    roll = (noise[:, :-4] + noise[:, 1:-3] + noise[:, 2:-2] + noise[:, 3:-1] + noise[:, 4:]) / 5
+    return np.clip(roll, 0, 255).astype(np.uint8)
+
+def periodic_roll(length, period=64, seed=0):
+    """Fabric texture repeating every period rows along the roll."""
+    tile = textured_roll(period, seed)
+    return np.tile(tile, (length // period + 1, 1))[:length]
+
+def frame(roll, top, drift=0):
+    """Frame as returned by preprocess_frame, with its first row at row top of the roll."""
+    gray = np.roll(roll[top:top + HEIGHT], drift, axis=1)
+    return np.repeat(gray[..., None], 3, axis=2)
+
+def entry(pos_x, pos_y, tracker, class_name='thread error'):
+    roll_x_cm, roll_y_cm = tracker.roll_position_cm(pos_x, pos_y)
+    return {'class': class_name, 'roll_x_cm': roll_x_cm, 'roll_y_cm': roll_y_cm}
+
+@pytest.mark.parametrize('stride', [300, 400, 470])
+@pytest.mark.parametrize('drift', [0, 3])
+def test_overlapping_frames_give_the_stride(stride, drift):
+    roll = textured_roll(3 * HEIGHT)
+    tracker = RollTracker(CM_PER_PX, CELL_SIZE)
+
+    assert tracker.advance(10, frame(roll, 0)) == 10 * HEIGHT
+    offset = tracker.advance(11, frame(roll, stride, drift))
+
+    assert tracker.overlapping
+    assert offset - 10 * HEIGHT == pytest.approx(stride, abs=1)
+
+def test_static_content_does_not_overlap():
+    roll = textured_roll(HEIGHT)
+    tracker = RollTracker(CM_PER_PX, CELL_SIZE)
+
+    tracker.advance(0, frame(roll, 0))
+    assert tracker.advance(1, frame(roll, 0)) == HEIGHT
+    assert not tracker.overlapping
+
+@pytest.mark.parametrize('period', [32, 64, 100])
+def test_periodic_frames_without_overlap_do_not_overlap(period):
+    roll = periodic_roll(4 * HEIGHT, period)
+    tracker = RollTracker(CM_PER_PX, CELL_SIZE)
+
+    tracker.advance(0, frame(roll, 0))
+    assert tracker.advance(1, frame(roll, HEIGHT + 37)) == HEIGHT
+    assert not tracker.overlapping
+
+def test_thread_error_along_periodic_fabric_is_kept_in_every_frame():
+    roll = periodic_roll(4 * HEIGHT)
+    tracker = RollTracker(CM_PER_PX, CELL_SIZE)
+
+    tracker.advance(0, frame(roll, 0))
+    assert tracker.deduplicate([entry(320, 480, tracker)]) == [0]
+    tracker.advance(1, frame(roll, HEIGHT + 37))
+    assert tracker.deduplicate([entry(320, 0, tracker)]) == [0]
+
+def test_repeats_in_the_overlap_are_merged():
+    roll = textured_roll(2 * HEIGHT)
+    tracker = RollTracker(CM_PER_PX, CELL_SIZE)
+
+    tracker.advance(0, frame(roll, 0))
+    assert tracker.deduplicate([entry(320, 448, tracker), entry(64, 64, tracker)]) == [0, 1]
+    tracker.advance(1, frame(roll, 400))
+    assert tracker.deduplicate([entry(320, 48, tracker), entry(64, 300, tracker)]) == [1]
+
+def test_dedup_off_keeps_repeats():
+    roll = textured_roll(2 * HEIGHT)
+    tracker = RollTracker(CM_PER_PX, CELL_SIZE, dedup=False)
+
+    tracker.advance(0, frame(roll, 0))
+    tracker.deduplicate([entry(320, 448, tracker)])
+    tracker.advance(1, frame(roll, 400))
+    assert tracker.overlapping
+    assert tracker.deduplicate([entry(320, 48, tracker)]) == [0]
@@ -0,0 +1,57 @@
+import json
+import pytest
+import server
+from events import new_epoch, format_version, parse_version
+from rollmap import RollmapRenderer
+
+def test_parse_version():
+    epoch = new_epoch()
+    assert parse_version(format_version(epoch, 3), epoch) == 3
+    assert parse_version(format_version(new_epoch(), 3), epoch) == -1
+    assert parse_version(None, epoch) == -1
+    assert parse_version('3', epoch) == -1
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    rollmaps_folder = tmp_path / 'working' / '1' / 'rollmaps'
+    rollmaps_folder.mkdir(parents=True)
+    (tmp_path / 'active_session.json').write_text(json.dumps({'active_session': '1'}))
+
+    monkeypatch.setattr(server, 'BASE_DIR', str(tmp_path))
+    monkeypatch.setattr(server, 'session_folder', str(tmp_path / 'working' / '1'))
+    monkeypatch.setattr(server, 'rollmap_renderer', RollmapRenderer(str(rollmaps_folder)))
+    monkeypatch.setattr(server, 'last_frame', (3, b'jpeg'))
+    monkeypatch.setattr(server, 'ready_frame', None)
+    yield server.app.test_client()
+    server.clear_defect_stores()
+
+def restart(monkeypatch):
+    """Versions of a new process, with the same counters."""
+    monkeypatch.setattr(server, 'FRAME_EPOCH', new_epoch())
+    monkeypatch.setattr(server, 'rollmap_renderer', RollmapRenderer(server.rollmap_renderer.rollmaps_folder))
+
+def test_last_frame_etag_changes_with_the_process(client, monkeypatch):
+    etag = client.get('/frames/last').headers['ETag']
+    assert client.get('/frames/last', headers={'If-None-Match': etag}).status_code == 304
+
+    restart(monkeypatch)
+    assert client.get('/frames/last', headers={'If-None-Match': etag}).status_code == 200
+
+def test_delta_versions_change_with_the_process(client, monkeypatch):
+    renderer = server.rollmap_renderer
+    renderer.add_defects([{'roll_x_cm': 1.0, 'roll_y_cm': 10.0, 'class': 'hole'}])
+    renderer.render()
+
+    first = client.get('/get-frame', query_string={'frame_version': '', 'rollmap_version': ''}).get_json()
+    assert first['frame_url'] == '/frames/last' and len(first['rollmaps']) == 1
+
+    versions = {'frame_version': first['frame_version'], 'rollmap_version': first['rollmap_version']}
+    unchanged = client.get('/get-frame', query_string=versions).get_json()
+    assert unchanged['frame_url'] is None and unchanged['rollmaps'] == []
+
+    # Same counters in a new process, the client still gets everything again
+    restart(monkeypatch)
+    server.rollmap_renderer.add_defects([{'roll_x_cm': 1.0, 'roll_y_cm': 10.0, 'class': 'hole'}])
+    server.rollmap_renderer.render()
+    after_restart = client.get('/get-frame', query_string=versions).get_json()
+    assert after_restart['frame_url'] == '/frames/last' and len(after_restart['rollmaps']) == 1
@@ -0,0 +1,97 @@
+import cv2
+import numpy as np
+import pytest
+import video
+from video import sample_video_frames, sample_video_frames_parallel, seek_video
+
+FRAMES = 250
+WIDTH, HEIGHT = 160, 128
+
+def frame_number(frame):
+    """Frame index written by the video_path fixture, read back from the two gray blocks."""
+    high = int(round((frame[:HEIGHT // 2, :WIDTH // 2].mean() - 8) / 16))
+    low = int(round((frame[HEIGHT // 2:, :WIDTH // 2].mean() - 8) / 16))
+    return high * 16 + low
+
+@pytest.fixture(scope='module')
+def video_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('video') / 'synthetic.mp4')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 60, (WIDTH, HEIGHT))
+    for i in range(FRAMES):
+        frame = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+        frame[:HEIGHT // 2, :WIDTH // 2] = (i // 16) * 16 + 8
+        frame[HEIGHT // 2:, :WIDTH // 2] = (i % 16) * 16 + 8
+        writer.write(frame)
+    writer.release()
+    return path
+
+@pytest.mark.parametrize('skip_decode', [True, False])
+def test_sampled_frames_are_the_indexed_frames(video_path, skip_decode):
+    sampled = list(sample_video_frames(video_path, 7, skip_decode))
+    assert [index for index, _ in sampled] == list(range(0, FRAMES, 7))
+    assert [frame_number(frame) for _, frame in sampled] == list(range(0, FRAMES, 7))
+
+@pytest.mark.parametrize('start_frame', [1, 50, 133, 247])
+def test_segments_start_on_their_frame(video_path, start_frame):
+    sampled = list(sample_video_frames(video_path, 1, start_frame=start_frame, end_frame=start_frame + 3))
+    assert [index for index, _ in sampled] == [frame_number(frame) for _, frame in sampled]
+    assert sampled[0][0] == start_frame
+
+def test_parallel_and_sequential_frames_match(video_path, monkeypatch):
+    # Many short segments, so most of them start with a seek
+    monkeypatch.setattr(video, 'SEGMENT_SAMPLES', 3)
+
+    sequential = list(sample_video_frames(video_path, 7))
+    parallel = list(sample_video_frames_parallel(video_path, 7, workers=2))
+
+    assert [index for index, _ in parallel] == [index for index, _ in sequential]
+    assert [frame_number(frame) for _, frame in parallel] == [index for index, _ in sequential]
+
+def shrink(frame):
+    return cv2.resize(frame, (WIDTH // 2, HEIGHT // 2), interpolation=cv2.INTER_AREA)
+
+def test_parallel_workers_preprocess_the_frames(video_path, monkeypatch):
+    monkeypatch.setattr(video, 'SEGMENT_SAMPLES', 3)
+
+    sequential = list(sample_video_frames(video_path, 7))
+    parallel = list(sample_video_frames_parallel(video_path, 7, workers=2, preprocess=shrink))
+
+    assert [index for index, _ in parallel] == [index for index, _ in sequential]
+    for (_, frame), (_, original) in zip(parallel, sequential):
+        np.testing.assert_array_equal(frame, shrink(original))
+
+class KeyframeCapture:
+    """Capture that seeks to the keyframe before the requested frame, and can be told to report it or not."""
+
+    def __init__(self, keyframe_interval, reports_position=True):
+        self.keyframe_interval = keyframe_interval
+        self.reports_position = reports_position
+        self.position = 0
+        self.requested = 0
+        self.opened = 0
+
+    def set(self, prop, value):
+        self.requested = value
+        self.position = value - value % self.keyframe_interval
+        return True
+
+    def get(self, prop):
+        return self.position if self.reports_position else self.requested + 1000
+
+    def open(self, path):
+        self.opened += 1
+        self.position = 0
+
+    def grab(self):
+        self.position += 1
+        return True
+
+def test_seek_grabs_forward_from_the_reported_position():
+    cap = KeyframeCapture(10)
+    assert seek_video(cap, 'video.mp4', 57) == 57
+    assert cap.position == 57 and cap.opened == 0
+
+def test_seek_starts_over_when_the_position_is_wrong():
+    cap = KeyframeCapture(10, reports_position=False)
+    assert seek_video(cap, 'video.mp4', 57) == 57
+    assert cap.position == 57 and cap.opened == 1
@@ -0,0 +1,15 @@
+import os
+import sys
+import subprocess
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_importing_server_is_light():
+    # What a spawned decode or inference worker runs before its first task
+    check = ("import runpy, sys\n"
+             "module = runpy.run_path('server.py', run_name='__mp_main__')\n"
+             "assert module['inference_pool'] is None and module['model_cache'] is None\n"
+             "print(' '.join(name for name in ('torch', 'ultralytics', 'onnxruntime') if name in sys.modules))\n")
+    result = subprocess.run([sys.executable, '-c', check], cwd=SERVICE_DIR, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ''
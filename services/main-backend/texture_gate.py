@@ -0,0 +1,132 @@
+import os
+import json
+import zipfile
+import threading
+import cv2
+import numpy as np
+
+# Share of the good calibration cells left inside the envelope, the rest is split between both tails
+TEXTURE_GATE_COVERAGE = 0.99
+TEXTURE_STATS = ('mean', 'variance', 'gradient_energy')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def texture_stats(cells):
+    """
+    Mean, variance and gradient energy of every cell, computed for the whole batch at once.
+
+    Args:
+        cells (np.ndarray): Gray cells of shape (cells, height, width, channels),
+            only the first channel is used.
+
+    Returns:
+        np.ndarray: Array of shape (cells, 3) with the statistics in TEXTURE_STATS order.
+    """
+    gray = cells[..., 0].astype(np.float32)
+    mean = gray.mean(axis=(1, 2))
+    variance = gray.var(axis=(1, 2))
+    gradient_energy = np.square(np.diff(gray, axis=1)).mean(axis=(1, 2)) + \
+        np.square(np.diff(gray, axis=2)).mean(axis=(1, 2))
+    return np.stack([mean, variance, gradient_energy], axis=1)
+
+def read_class_cells(zip_file, class_name, cell_size):
+    """
+    Gray cells of one class from a dataset zip, resized to the inference cell size.
+
+    Images are taken from any folder named class_name, so both flat
+    (<class>/) and split (train/<class>/) datasets work.
+    """
+    cells = []
+    with zipfile.ZipFile(zip_file) as archive:
+        for member in archive.namelist():
+            if class_name in os.path.dirname(member).split('/') and member.lower().endswith(IMAGE_EXTENSIONS):
+                image = cv2.imdecode(np.frombuffer(archive.read(member), np.uint8), cv2.IMREAD_GRAYSCALE)
+                if image is not None:
+                    cells.append(cv2.resize(image, (cell_size, cell_size))[..., None])
+
+    return np.stack(cells) if cells else np.zeros((0, cell_size, cell_size, 1), np.uint8)
+
+class TextureGate:
+    """
+    Envelope of the texture statistics of defect free fabric cells.
+
+    Cells with all their statistics inside the envelope are taken as good
+    without going through the model. In audit mode every cell still goes
+    through the model, to measure how many defects the gate would miss.
+    """
+
+    def __init__(self, low, high, enabled=True, audit=False, calibration_cells=0):
+        self.low = np.asarray(low, np.float32)
+        self.high = np.asarray(high, np.float32)
+        self.enabled = enabled
+        self.audit = audit
+        self.calibration_cells = calibration_cells
+
+    @classmethod
+    def calibrate(cls, good_cells, coverage=TEXTURE_GATE_COVERAGE):
+        stats = texture_stats(good_cells)
+        tail = (1 - coverage) / 2
+        return cls(np.quantile(stats, tail, axis=0), np.quantile(stats, 1 - tail, axis=0),
+                   calibration_cells=len(good_cells))
+
+    def needs_inference(self, cells):
+        """Mask of the cells outside the good envelope."""
+        stats = texture_stats(cells)
+        return ((stats < self.low) | (stats > self.high)).any(axis=1)
+
+    def to_dict(self):
+        return {
+            'enabled': self.enabled,
+            'audit': self.audit,
+            'calibration_cells': self.calibration_cells,
+            'low': dict(zip(TEXTURE_STATS, self.low.tolist())),
+            'high': dict(zip(TEXTURE_STATS, self.high.tolist()))
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls([data['low'][stat] for stat in TEXTURE_STATS], [data['high'][stat] for stat in TEXTURE_STATS],
+                   data['enabled'], data['audit'], data['calibration_cells'])
+
+    def save(self, path):
+        with open(path, 'w') as gate_file:
+            json.dump(self.to_dict(), gate_file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as gate_file:
+            return cls.from_dict(json.load(gate_file))
+
+class TextureGateCounters:
+    """
+    Cells seen and gated by the texture gate, summed over the reports of the inference stage.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.cells = 0
+            self.gated = 0
+            self.audited_defects = 0
+            self.missed_defects = 0
+
+    def add(self, report):
+        with self.lock:
+            self.cells += report['cells']
+            self.gated += report['gated']
+            if report['audit']:
+                self.audited_defects += report['defects']
+                self.missed_defects += report['missed_defects']
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'cells': self.cells,
+                'gated_cells': self.gated,
+                'gated_ratio': self.gated / self.cells if self.cells else 0,
+                'audited_defects': self.audited_defects,
+                'missed_defects': self.missed_defects,
+                'recall_loss': self.missed_defects / self.audited_defects if self.audited_defects else None
+            }
@@ -0,0 +1,139 @@
+import cv2
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of sampled frames decoded by a worker in one segment
+SEGMENT_SAMPLES = 32
+
+def seek_video(cap, video_path, frame_index):
+    """
+    Move a capture to a frame, so the next grab returns it.
+
+    Seeking may be unsupported, or land on another frame (a keyframe) while
+    the capture still counts from the requested one. The position is read
+    back after seeking, and the capture grabs forward from it when it is
+    before the frame. When it can't be trusted the video is opened again and
+    grabbed forward from its start.
+
+    Returns:
+        int: Index of the frame the next grab returns, below frame_index only
+            if the video ends before it.
+    """
+    if frame_index <= 0:
+        return 0
+
+    position = None
+    if cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index):
+        position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+
+    if position is None or not 0 <= position <= frame_index:
+        cap.open(video_path)
+        position = 0
+
+    while position < frame_index and cap.grab():
+        position += 1
+    return position
+
+def sample_video_frames(video_path, frame_skip, skip_decode=True, start_frame=0, end_frame=None, preprocess=None):
+    """
+    Yield every frame_skip-th frame of a video, counting from frame 0.
+
+    With skip_decode the unwanted frames are only grabbed (demuxed) and never
+    retrieved, so their pixels are not decoded into images. Frame indices are
+    the same in both modes.
+
+    Args:
+        video_path (str): Path to the video file.
+        frame_skip (int): Keep one frame every frame_skip frames.
+        skip_decode (bool): Skip pixel decoding of the frames that are not kept.
+        start_frame (int): First frame to read, see seek_video.
+        end_frame (int): Stop before this frame, or read to the end if None.
+        preprocess (callable): Applied to each kept frame, if given.
+
+    Yields:
+        tuple: (frame_index, frame) for each kept frame.
+    """
+    cap = cv2.VideoCapture(video_path)
+    frame_count = seek_video(cap, video_path, start_frame)
+
+    try:
+        while end_frame is None or frame_count < end_frame:
+            keep = frame_count % frame_skip == 0
+
+            if skip_decode:
+                success = cap.grab()
+                if success and keep:
+                    success, frame = cap.retrieve()
+            else:
+                success, frame = cap.read()
+
+            if not success:
+                break
+
+            if keep:
+                yield frame_count, preprocess(frame) if preprocess else frame
+
+            frame_count += 1
+    finally:
+        # Release the video capture object
+        cap.release()
+
+def count_video_frames(video_path):
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return total_frames
+
+def decode_segment(video_path, frame_skip, skip_decode, start_frame, end_frame, preprocess):
+    return list(sample_video_frames(video_path, frame_skip, skip_decode, start_frame, end_frame, preprocess))
+
+def sample_video_frames_parallel(video_path, frame_skip, workers, skip_decode=True, preprocess=None):
+    """
+    Same frames as sample_video_frames, decoded by a pool of worker processes.
+
+    The video is split into time segments of SEGMENT_SAMPLES sampled frames.
+    Each worker seeks to the start of its segment and decodes it on its own.
+    Segments are yielded back in order, so frame indices match a sequential run.
+    At most 2 segments per worker are in flight, bounding memory use.
+    Frames are preprocessed in the workers, so only the smaller preprocessed
+    frames are sent back.
+
+    Args:
+        video_path (str): Path to the video file.
+        frame_skip (int): Keep one frame every frame_skip frames.
+        workers (int): Number of worker processes, 1 decodes sequentially.
+        skip_decode (bool): Skip pixel decoding of the frames that are not kept.
+        preprocess (callable): Applied to each kept frame, must be a module
+            level function so the workers can unpickle it.
+
+    Yields:
+        tuple: (frame_index, frame) for each kept frame.
+    """
+    total_frames = count_video_frames(video_path)
+    if workers <= 1 or total_frames <= 0:
+        yield from sample_video_frames(video_path, frame_skip, skip_decode, preprocess=preprocess)
+        return
+
+    # Segment boundaries fall on kept frames
+    segment_length = frame_skip * SEGMENT_SAMPLES
+    starts = list(range(0, total_frames, segment_length))
+
+    # Spawn keeps the workers from inheriting the server threads and model
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        try:
+            for i, start in enumerate(starts):
+                # The frame count is only an estimate, the last segment reads to the end
+                end = starts[i + 1] if i + 1 < len(starts) else None
+                pending.append(executor.submit(decode_segment, video_path, frame_skip, skip_decode, start, end, preprocess))
+
+                if len(pending) >= workers * 2:
+                    yield from pending.popleft().result()
+
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
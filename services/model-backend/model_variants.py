@@ -0,0 +1,192 @@
+import os
+import time
+import shutil
+import cv2
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnxruntime.quantization import quantize_dynamic, QuantType
+
+# Number of cells main-backend classifies per frame (768x512 frame, 64px cells)
+BENCHMARK_BATCH_SIZE = 96
+
+# Largest accuracy drop (top1, absolute) accepted when picking the fastest variant
+MAX_ACCURACY_DROP = 0.01
+
+# Variant the accuracy deltas are measured against
+BASELINE_VARIANT = 'dynamic'
+
+def fix_input_size(onnx_path, imgsz):
+    """
+    Make the batch the only dynamic dimension of an ONNX model input.
+
+    Ultralytics exports with dynamic=True make the height and width dynamic
+    too, the model is only ever fed imgsz cells.
+
+    Parameters:
+    ----------
+    onnx_path: str
+        ONNX file, rewritten in place.
+    imgsz: int
+        Input size of the model.
+    """
+    model = onnx.load_model(onnx_path)
+    dims = model.graph.input[0].type.tensor_type.shape.dim
+    for dim in dims[2:]:
+        dim.dim_value = imgsz
+
+    # Shapes inferred from the dynamic input are inferred again
+    del model.graph.value_info[:]
+    onnx.save_model(onnx.shape_inference.infer_shapes(model), onnx_path)
+
+def export_onnx_variants(model, weights_folder, imgsz=64):
+    """
+    Export the trained model as a dynamic batch ONNX and an INT8 quantized copy of it.
+
+    The fixed batch export already in best.onnx is kept as the 'fixed' variant.
+    Only the batch of the dynamic variants is dynamic, their input is imgsz cells.
+
+    Parameters:
+    ----------
+    model: ultralytics.YOLO
+        The trained model.
+    weights_folder: str
+        Folder of the run weights, the variants are written there.
+    imgsz: int
+        Input size of the model.
+
+    Returns:
+    -------
+    variants: dict[str, str]
+        Path of the ONNX file of every variant, by variant name.
+    """
+    # Ultralytics always exports to best.onnx, move the fixed batch export out of the way
+    fixed_path = os.path.join(weights_folder, "fixed.onnx")
+    shutil.move(os.path.join(weights_folder, "best.onnx"), fixed_path)
+
+    exported_path = model.export(format="onnx", dynamic=True, imgsz=imgsz)
+    dynamic_path = os.path.join(weights_folder, "dynamic.onnx")
+    shutil.move(exported_path, dynamic_path)
+    fix_input_size(dynamic_path, imgsz)
+
+    int8_path = os.path.join(weights_folder, "int8.onnx")
+    quantize_dynamic(dynamic_path, int8_path, weight_type=QuantType.QUInt8)
+
+    return {'fixed': fixed_path, 'dynamic': dynamic_path, 'int8': int8_path}
+
+def load_test_split(dataset_folder, imgsz=64):
+    """
+    Load the test split of a classification dataset, preprocessed like the ultralytics predictor.
+
+    Parameters:
+    ----------
+    dataset_folder: str
+        Dataset folder with a test/<class name>/ folder per class.
+    imgsz: int
+        Input size of the model.
+
+    Returns:
+    -------
+    images: np.ndarray
+        Float32 RGB images in [0, 1] of shape (N, 3, imgsz, imgsz).
+    labels: np.ndarray
+        Class index of every image, classes sorted by name as in training.
+    """
+    test_folder = os.path.join(dataset_folder, 'test')
+    images = []
+    labels = []
+    for label, class_name in enumerate(sorted(os.listdir(test_folder))):
+        class_folder = os.path.join(test_folder, class_name)
+        for file_name in sorted(os.listdir(class_folder)):
+            image = cv2.imread(os.path.join(class_folder, file_name))
+            if image is None:
+                continue
+            image = cv2.resize(image, (imgsz, imgsz))
+            images.append(image[..., ::-1].transpose(2, 0, 1))
+            labels.append(label)
+
+    images = np.stack(images).astype(np.float32) / 255
+    return images, np.array(labels)
+
+def benchmark_onnx_model(model_path, images, labels, batch_size=BENCHMARK_BATCH_SIZE):
+    """
+    Measure the CPU latency, throughput and accuracy of an ONNX classifier.
+
+    Models exported with a fixed batch size get every batch padded to that size,
+    as main-backend does.
+
+    Returns:
+    -------
+    metrics: dict[str, float]
+        latency-ms (per batch), throughput-cells-s and accuracy_top1.
+    """
+    session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+    model_input = session.get_inputs()[0]
+    fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
+    def run(batch):
+        inputs = batch
+        if fixed_batch:
+            inputs = np.zeros((fixed_batch, *batch.shape[1:]), np.float32)
+            inputs[:len(batch)] = batch
+        return session.run(None, {model_input.name: inputs})[0][:len(batch)]
+
+    # Warm up
+    run(images[:batch_size])
+
+    predictions = []
+    latencies = []
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        begin = time.perf_counter()
+        predictions.append(run(batch).argmax(axis=1))
+        latencies.append(time.perf_counter() - begin)
+
+    predictions = np.concatenate(predictions)
+    return {
+        'latency-ms': float(np.median(latencies) * 1000),
+        'throughput-cells-s': float(len(images) / sum(latencies)),
+        'accuracy_top1': float((predictions == labels).mean())
+    }
+
+def benchmark_variants(variants, dataset_folder, imgsz=64):
+    """
+    Benchmark every variant on the test split, adding the accuracy delta to the baseline.
+
+    Returns:
+    -------
+    metrics: dict[str, dict[str, float]]
+        Metrics of every variant, by variant name.
+    """
+    images, labels = load_test_split(dataset_folder, imgsz)
+    metrics = {name: benchmark_onnx_model(path, images, labels) for name, path in variants.items()}
+
+    baseline_accuracy = metrics[BASELINE_VARIANT]['accuracy_top1']
+    for variant_metrics in metrics.values():
+        variant_metrics['accuracy-delta'] = variant_metrics['accuracy_top1'] - baseline_accuracy
+    return metrics
+
+def select_fastest_variant(run_metrics, max_accuracy_drop=MAX_ACCURACY_DROP):
+    """
+    Pick the variant with the lowest latency among those within the accuracy bar.
+
+    Parameters:
+    ----------
+    run_metrics: dict[str, float]
+        Metrics of the MLflow run, as logged by train_yolo_model.
+    max_accuracy_drop: float
+        Largest accepted accuracy drop from the baseline.
+
+    Returns:
+    -------
+    variant: str
+        Name of the variant, or None if the run has no benchmarked variants.
+    """
+    candidates = []
+    for key, latency in run_metrics.items():
+        if key.startswith('variant.') and key.endswith('.latency-ms'):
+            name = key[len('variant.'):-len('.latency-ms')]
+            if run_metrics.get(f'variant.{name}.accuracy-delta', -1) >= -max_accuracy_drop:
+                candidates.append((latency, name))
+
+    return min(candidates)[1] if candidates else None
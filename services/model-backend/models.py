@@ -14,6 +14,7 @@ import random
 import numpy as np
 import torch
 from mlflow.entities.model_registry import ModelVersion
+from model_variants import MAX_ACCURACY_DROP, export_onnx_variants, benchmark_variants, select_fastest_variant
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 app = Flask(__name__)
@@ -129,6 +130,18 @@ def train_yolo_model(data, zip_path, dataset_info):
             model_info = mlflow.onnx.log_model(onnx_model, "model", registered_model_name="test01")
             client.set_registered_model_alias("test01", model_name, model_info.registered_model_version)
 
+            # Export optimized variants, benchmarked on the test split at the frame pipeline batch size
+            try:
+                variants = export_onnx_variants(model, os.path.dirname(model_onnx_path))
+                for variant_name, variant_metrics in benchmark_variants(variants, model_folder).items():
+                    for key, value in variant_metrics.items():
+                        mlflow.log_metric(f"variant.{variant_name}.{key}", value)
+                for variant_path in variants.values():
+                    mlflow.log_artifact(variant_path, artifact_path="variants")
+            except Exception as e:
+                print("Error exporting model variants:", str(e))
+                mlflow.log_param("variants_error", str(e))
+
         training_status['progress'] = 'Training completed successfully.'
 
     except Exception as e:
@@ -240,26 +253,65 @@ def list_registered_models():
 def fetch_model():
     """
     Fetch the registered model from the MLflow registry using the alias provided as a query parameter
-    and return the model weights file.
+    and return the model weights file, or its ONNX export with format=onnx.
+
+    For ONNX, variant selects 'fixed', 'dynamic' or 'int8'. The default, 'fastest', picks
+    the lowest latency variant within max_accuracy_drop of the baseline accuracy, and
+    falls back to the registered model for runs without benchmarked variants.
     """
     model_name = request.args.get('model')
     if not model_name:
         return jsonify({'error': 'Model name not provided'}), 400
 
+    model_format = request.args.get('format', 'pt')
+    if model_format not in ('pt', 'onnx'):
+        return jsonify({'error': 'Model format must be pt or onnx'}), 400
+
     try:
         client = mlflow.tracking.MlflowClient()
         model_version = client.get_model_version_by_alias("test01", model_name)
         run_id = model_version.run_id
         artifacts_uri = client.get_run(run_id).info.artifact_uri
-        model_file_path = os.path.join(artifacts_uri, "weights", "best.pt")
+        variant = None
+        if model_format == 'onnx':
+            variant = request.args.get('variant', 'fastest')
+            if variant == 'fastest':
+                max_accuracy_drop = request.args.get('max_accuracy_drop', MAX_ACCURACY_DROP, type=float)
+                variant = select_fastest_variant(client.get_run(run_id).data.metrics, max_accuracy_drop)
+
+            if variant:
+                model_file_path = os.path.join(artifacts_uri, "variants", f"{variant}.onnx")
+            else:
+                model_file_path = os.path.join(artifacts_uri, "model", "model.onnx")
+        else:
+            model_file_path = os.path.join(artifacts_uri, "weights", "best.pt")
         
         if os.path.exists(model_file_path):
-            return send_file(model_file_path, as_attachment=True)
+            response = send_file(model_file_path, as_attachment=True)
+            if variant:
+                response.headers['X-Model-Variant'] = variant
+            return response
         else:
             return jsonify({'error': 'Model file not found'}), 404
     except Exception as e:
         return jsonify({'error': f'Failed to fetch model: {str(e)}'}), 500
 
+@app.route('/model_version', methods=['GET'])
+def model_version():
+    """
+    Return the registry version currently pointed to by a model alias,
+    so clients can tell if a model they already loaded is still current.
+    """
+    model_name = request.args.get('model')
+    if not model_name:
+        return jsonify({'error': 'Model name not provided'}), 400
+
+    try:
+        model_version = get_model_version_by_alias("test01", model_name)
+        return jsonify({'model': model_name, 'version': model_version.version, 'run_id': model_version.run_id}), 200
+    except Exception as e:
+        return jsonify({'error': f'Failed to fetch model version: {str(e)}'}), 500
+
 def get_model_version_by_alias(name: str, alias: str) -> ModelVersion:
     # This function should use mlflow to get the model version by alias
     client = mlflow.tracking.MlflowClient()
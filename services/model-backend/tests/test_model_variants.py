@@ -0,0 +1,102 @@
+import os
+import cv2
+import numpy as np
+import onnx
+import onnxruntime as ort
+import pytest
+from onnx import helper, TensorProto
+from model_variants import export_onnx_variants, benchmark_variants, select_fastest_variant
+
+IMGSZ = 64
+CLASSES = ['0_red', '1_green', '2_blue']
+
+def write_classifier(onnx_path, batch='batch', size=None):
+    """
+    ONNX classifier of the dominant RGB channel, with the input dimensions of an ultralytics export.
+
+    The defaults match dynamic=True, an int batch and size match batch=N.
+    """
+    height, width = (size, size) if size else ('height', 'width')
+    images = helper.make_tensor_value_info('images', TensorProto.FLOAT, [batch, 3, height, width])
+    output = helper.make_tensor_value_info('output0', TensorProto.FLOAT, [batch, 3])
+    weights = helper.make_tensor('weights', TensorProto.FLOAT, [3, 3, 1, 1], np.eye(3, dtype=np.float32).ravel())
+    graph = helper.make_graph([
+        helper.make_node('Conv', ['images', 'weights'], ['features']),
+        helper.make_node('GlobalAveragePool', ['features'], ['pooled']),
+        helper.make_node('Flatten', ['pooled'], ['logits']),
+        helper.make_node('Softmax', ['logits'], ['output0'], axis=1)
+    ], 'classifier', [images], [output], [weights])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.save_model(model, onnx_path)
+    return onnx_path
+
+class FakeYolo:
+    """ultralytics.YOLO exporting the classifier next to best.onnx, as export(dynamic=True) does."""
+
+    def __init__(self, weights_folder):
+        self.weights_folder = weights_folder
+
+    def export(self, format, dynamic, imgsz):
+        return write_classifier(os.path.join(self.weights_folder, 'best.onnx'))
+
+@pytest.fixture
+def variants(tmp_path):
+    weights_folder = tmp_path / 'weights'
+    weights_folder.mkdir()
+    write_classifier(str(weights_folder / 'best.onnx'), batch=999, size=IMGSZ)
+    return export_onnx_variants(FakeYolo(str(weights_folder)), str(weights_folder), IMGSZ)
+
+@pytest.fixture
+def dataset_folder(tmp_path):
+    rng = np.random.default_rng(0)
+    for label, class_name in enumerate(CLASSES):
+        class_folder = tmp_path / 'dataset' / 'test' / class_name
+        class_folder.mkdir(parents=True)
+        for i in range(40):
+            image = rng.integers(0, 100, (IMGSZ, IMGSZ, 3), dtype=np.uint8)
+            # BGR on disk
+            image[..., 2 - label] += 120
+            cv2.imwrite(str(class_folder / f'{i}.png'), image)
+    return str(tmp_path / 'dataset')
+
+def test_variants_only_have_a_dynamic_batch(variants):
+    assert set(variants) == {'fixed', 'dynamic', 'int8'}
+    for name, path in variants.items():
+        batch, *dims = ort.InferenceSession(path, providers=['CPUExecutionProvider']).get_inputs()[0].shape
+        # main-backend feeds CELL_SIZE cells, only the batch may be a name
+        assert dims == [3, IMGSZ, IMGSZ], name
+        assert batch == 999 if name == 'fixed' else isinstance(batch, str)
+
+def test_benchmark_variants(variants, dataset_folder):
+    metrics = benchmark_variants(variants, dataset_folder, IMGSZ)
+
+    assert set(metrics) == set(variants)
+    for variant_metrics in metrics.values():
+        assert variant_metrics['latency-ms'] > 0
+        assert variant_metrics['throughput-cells-s'] > 0
+        assert variant_metrics['accuracy_top1'] == pytest.approx(1)
+        assert variant_metrics['accuracy-delta'] == pytest.approx(0)
+
+    # Logged as train_yolo_model does, the variant picked is one that was benchmarked
+    run_metrics = {f'variant.{name}.{key}': value
+                   for name, variant_metrics in metrics.items() for key, value in variant_metrics.items()}
+    assert select_fastest_variant(run_metrics) in variants
+
+def test_select_fastest_variant_within_the_accuracy_bar():
+    run_metrics = {
+        'metrics/accuracy_top1': 0.9,
+        'variant.fixed.latency-ms': 30.0, 'variant.fixed.accuracy-delta': 0.0,
+        'variant.dynamic.latency-ms': 10.0, 'variant.dynamic.accuracy-delta': 0.0,
+        'variant.int8.latency-ms': 4.0, 'variant.int8.accuracy-delta': -0.02
+    }
+    assert select_fastest_variant(run_metrics) == 'dynamic'
+    assert select_fastest_variant(run_metrics, max_accuracy_drop=0.05) == 'int8'
+
+def test_select_fastest_variant_skips_variants_without_accuracy():
+    run_metrics = {'variant.int8.latency-ms': 4.0,
+                   'variant.dynamic.latency-ms': 10.0, 'variant.dynamic.accuracy-delta': 0.0}
+    assert select_fastest_variant(run_metrics) == 'dynamic'
+
+def test_select_fastest_variant_without_variants():
+    assert select_fastest_variant({'metrics/accuracy_top1': 0.9}) is None